@@ -4,445 +4,1315 @@ import fastaIO
 import sys
 import os
 import os.path
+import stat
+import io
+import mmap
+import gzip
+import zlib
+import struct
+import string
+import multiprocessing
+import threading
+import Queue
+import heapq
+import time
+import tempfile
+import json
+import resource
+import cProfile
+import cPickle
 import subprocess as subp
 from fastaIO import Vividict
-from collections import OrderedDict
-from operator import itemgetter
+from collections import OrderedDict, namedtuple, deque
+from multiprocessing.pool import ThreadPool
+from array import array
+from operator import itemgetter, attrgetter
+from itertools import islice, izip, count
 
-args = sys.argv[1:]
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+OUTPUT_BUFFER = 4 << 20
+
+default_options = OrderedDict([
+    ("line_width", 0),
+    ("compress", ""),
+    ("threads", 1),
+    ("unsorted", False),
+    ("numpy", False),
+    ("stats", ""),
+    ("cprofile", ""),
+    ("pyinstrument", ""),
+    ("report_format", "text"),
+    ("report_level", 2),
+    ("checkpoint", ""),
+    ("checkpoint_interval", 600.0),
+    ("resume", False),
+    ("rounds", 1),
+    ("aligner", "nucmer --maxmatch --nosimplify -p {prefix} {ref} {query} && show-coords -rclTo {prefix}.delta > {out}"),
+    ("find_overlaps", False),
+    ("overlap_k", 15),
+    ("overlap_window", 500),
+    ("overlap_min", 40),
+    ("prefilter", False),
+    ("prefilter_k", 21),
+    ("prefilter_containment", 0.95),
+    ("prefilter_scale", 1000),
+    ("decompress_threads", 2),
+    ("min_identity", 94.99),
+    ("covered_identity", 97.9),
+    ("near_coverage", 98.0),
+    ("near_identity", 98.0),
+    ("start_window", 24),
+    ("end_window", 23),
+    ("tags", "CONTAINS,IDENTITY,END,BEGIN,CONTAINED"),
+    ("thresholds", ""),
+    ("pass_through", False),
+    ("gfa", False),
+    ("output_prefix", ""),
+])
 
 def usage():
     print """
     Usage: 
-    parse_mummer_overlap_for_mix.py <mummer_overlap_tab_file> <assembly_fasta_file> <run_name>
+    parse_mummer_overlap_for_mix.py <mummer_overlap_tab_file> <assembly_fasta_file> <run_name> [options]
+
+    <mummer_overlap_tab_file> may be - to read the overlap lines from stdin, or a named pipe, so show-coords can stream straight into the merge (needs --output-prefix for -).
 
     This script parses a mummer/nucmer overlap output file in tabular format, finding the contigs wholely contained within other contigs. These are then removed from the assembly.
     
+    Options:
+    --line-width <int>        Wrap output fasta sequence lines at this many bases (default 0, no wrapping)
+    --compress <gzip|bgzip>   Compress the output fasta. bgzip output can be indexed directly with samtools faidx
+    --threads <int>           Merge independent groups of overlapping contigs in this many processes (default 1). Output is identical to a single process run
+    --unsorted                The overlap file is not sorted by reference. Lines are grouped by ref_name, in name order like a sorted file, through an offset index instead of an external sort
+    --numpy                   Read the overlap file in large chunks and drop self hits and low identity lines with numpy before they are parsed (needs numpy)
+    --stats <file>            Write a JSON summary of merge timings (with process_overlap split by overlap kind and case), filter counts, table sizes and the slowest reference groups
+    --cprofile <file>         Run under cProfile and dump the stats to this file (read with pstats)
+    --pyinstrument <file>     Run under pyinstrument and write its HTML report to this file (needs pyinstrument)
+    --report-format <format>  text (default), tsv or binary. The report is written as the merge runs
+    --report-level <int>      0 no report, 1 merge results only, 2 also every overlap case taken (default 2)
+    --checkpoint <file>       Save the merge state to this file between reference groups. Removed when the run finishes
+    --checkpoint-interval <seconds>  Time between checkpoints (default 600)
+    --resume                  Carry on from the --checkpoint file if there is one. Not available with --threads or --rounds
+    --rounds <int>            Merge up to this many rounds (default 1). After each round only the merged contigs are realigned against the round's output with --aligner, until a round merges nothing
+    --aligner <command>       Shell command producing a nucmer tab file of {query} against {ref} in {out}; {prefix} is a scratch file prefix (default nucmer + show-coords -rclTo). native uses the built-in overlap finder
+    --find-overlaps           Find the overlaps with the built-in finder instead of nucmer and write them to <mummer_overlap_tab_file> before merging
+    --overlap-k <int>         k-mer size of the built-in finder's seeds (default 15)
+    --overlap-window <int>    Bases at each contig end the built-in finder takes seeds from (default 500)
+    --overlap-min <int>       Shortest overlap the built-in finder reports (default 40)
+    --prefilter               Before merging, remove the contigs whose k-mer sketch is almost all found in a longer contig and report them as covered. Their overlap lines are skipped and --find-overlaps does not align them
+    --prefilter-k <int>       k-mer size of the prefilter sketches (default 21)
+    --prefilter-containment <float>  Share of a contig's sketch a longer contig must hold to remove it (default 0.95)
+    --prefilter-scale <int>   Keep one in this many k-mer hashes in the prefilter sketches (default 1000). Contigs too short to get 2 sketch hashes are left to the merge
+    --decompress-threads <int>  Threads inflating BGZF input blocks ahead of the parser (default 2)
+    --min-identity <float>    Skip overlap lines with this percent identity or less (default 94.99)
+    --covered-identity <float>  Least identity for a query fully inside a merged reference to be dropped as covered (default 97.9)
+    --near-coverage <float>   Least query coverage for a query to be dropped as 98% covered (default 98)
+    --near-identity <float>   Least identity for a query to be dropped as 98% covered (default 98)
+    --start-window <int>      An overlap starting before this reference position can extend the reference start (default 24)
+    --end-window <int>        An overlap ending less than this many bases from the reference end can extend the reference end (default 23)
+    --tags <list>             Comma separated nucmer tags; only lines with one of them are read (default CONTAINS,IDENTITY,END,BEGIN,CONTAINED)
+    --pass-through            Scan the overlap file first and only load the contigs its lines name. The other contigs are streamed from the fasta straight to the output, in their place. Not available with --prefilter or --find-overlaps
+    --gfa                     Also write the output contigs as GFA paths over the input contigs, with their orientations, to <mummer_overlap_tab_file>_<run_name>_contigs.gfa. With --rounds each round's file and the one traced back to the input contigs are written
+    --output-prefix <path>    Name the report, contigs and fasta outputs <path>_<run_name>... instead of after the input files. Needed when the overlap lines come from stdin
+    --thresholds <file>       JSON object of the threshold settings above, overriding the command line. A list of objects is a sweep: the overlap file is read once and merged under each set in turn, with _<name> (or _t<n>) added to the run name. Not available with --checkpoint or --rounds, and tags can not change within a sweep
+
+    Either input may be gzip or bgzip compressed. A compressed fasta is read into memory instead of being memory-mapped.
+    Overlap lines from stdin or a pipe are read once, front to back, so they can not be used with --unsorted, --pass-through, --checkpoint or --find-overlaps. With --threads the whole input is read before the merge starts.
     
     """
     sys.exit(-1)
 
-if len(args) != 3 or sys.argv[1] == '-h' or sys.argv[1] == '-help' or sys.argv[1] == '-H' or sys.argv[1] == '-Help' or sys.argv[1] == '--h' or sys.argv[1] == '--help':
-    usage()
+def parse_args(argv):
+    '''Splits argv into the three positional arguments and a dictionary of option settings.'''
+    args = []
+    options = OrderedDict(default_options)
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg in ('-h', '-help', '-H', '-Help', '--h', '--help'):
+            usage()
+        if arg.startswith("--"):
+            key = arg[2:].replace("-", "_")
+            if key not in default_options:
+                usage()
+            if isinstance(default_options[key], bool):
+                options[key] = True
+            else:
+                i += 1
+                if i == len(argv):
+                    usage()
+                try:
+                    options[key] = type(default_options[key])(argv[i])
+                except ValueError:
+                    usage()
+        else:
+            args.append(arg)
+        i += 1
+    if len(args) != 3:
+        usage()
+    if options["compress"] not in ("", "gzip", "bgzip"):
+        usage()
+    if options["report_format"] not in report_formats:
+        usage()
+    if options["resume"] and not options["checkpoint"]:
+        usage()
+    if options["checkpoint"] and options["threads"] > 1:
+        usage()
+    if options["resume"] and options["rounds"] > 1:
+        usage()
+    if options["pass_through"] and (options["prefilter"] or options["find_overlaps"]):
+        usage()
+    return args, options
+
+class Thresholds(object):
+    '''The cutoffs an overlap is compared against, converted once to typed values. Settings are the threshold options of default_options; name is added to the run name of a sweep.'''
+    settings = ("min_identity", "covered_identity", "near_coverage", "near_identity", "start_window", "end_window", "tags")
+
+    def __init__(self, name="", **values):
+        for key in values:
+            if key not in self.settings:
+                raise ValueError("Unknown threshold " + key)
+        for key in self.settings:
+            value = values.get(key, default_options[key])
+            if key == "tags" and not isinstance(value, basestring):
+                value = ",".join(value)
+            setattr(self, key, type(default_options[key])(value))
+        self.name = name
+        self.tag_list = tuple([intern(tag) for tag in self.tags.split(",") if tag])
+
+    def tagged(self, line):
+        '''True if line holds one of the tags. With no tags every line is read.'''
+        for tag in self.tag_list:
+            if tag in line:
+                return True
+        return not self.tag_list
+
+    def values(self):
+        return [getattr(self, key) for key in self.settings]
+
+thresholds = Thresholds()
+
+def threshold_sets(options):
+    '''Returns the list of Thresholds to merge under: the command line settings, overridden by each object of the --thresholds file.'''
+    base = dict([(key, options[key]) for key in Thresholds.settings])
+    if not options["thresholds"]:
+        return [Thresholds(**base)]
+    with open(options["thresholds"]) as f:
+        settings = json.load(f)
+    if isinstance(settings, dict):
+        settings = [settings]
+    sets = []
+    for i, values in enumerate(settings):
+        values = dict([(str(key), value) for key, value in values.iteritems()])
+        name = str(values.pop("name", "t%d" % (i + 1)))
+        merged = dict(base)
+        merged.update(values)
+        try:
+            sets.append(Thresholds(name, **merged))
+        except ValueError as e:
+            print options["thresholds"] + ":", e
+            sys.exit(-1)
+    if len(set([t.tags for t in sets])) > 1:
+        print options["thresholds"] + ": tags can not change within a sweep."
+        sys.exit(-1)
+    return sets
 
 '''
 Internal data formats
 
+Contig names are interned to int ids by contig_names (see ContigNames) and every table below is keyed by id. Ids follow sorted name order, so comparing two ids compares the names.
+
 seen dictionary:
-seen[ref_name][end of overlap relative to ref] = [len query extension, query_name, seq of extension, end of overlap relative to query, orientation of query to actual ref, actual ref_name to add extension to, which (ref or query) are combined, actual query_name, ori to actual query]
+seen[ref_id][end of overlap relative to ref] = {query_id: (hit order, (len query extension, query_id, (source sequence, start, stop, strand) of the extension, end of overlap relative to query, orientation of query to actual ref, actual ref_id to add extension to, which (ref or query) are combined, actual query_id, ori to actual query)), ...}
+Overlap ends are START or END. Each query keeps only its best hit at each end (see add_extension).
+
+good table (GoodTable):
+good.ref[best_query_contig] = ref_contig, or -1 if the contig is not in good
+good.ref_end[best_query_contig] = end of ref_contig extended
+good.query_end[best_query_contig] = end of query_contig used in extension
+good.ori[best_query_contig] = orientation of query to final orientation (either just to ref if it's a single contig or to the orientation of merged contigs)
+
+bad, processed:
+bytearrays of flags indexed by contig id
 
-good dictionary:
-good[best_query_contig] = [ref_contig, end of ref_contig extended, end of query_contig used in extension, orientation of query to final orientation (either just to ref if it's a single contig or to the orientation of merged contigs)]
+covers:
+covers[query_contig] = ref_contig the query was found to cover, or -1
+
+assembly dictionary:
+assembly[contig_id] = MappedSequence view into the memory-mapped fasta file for untouched contigs, or a Scaffold once the contig has been merged
+With --pass-through, assembly is a PassThroughAssembly holding only the contigs named in the overlap file.
+
+contigs dictionary:
+contigs[output contig_id] = Path of the input contigs it is built from, each with its orientation in the output contig. Several keys share one Path while a merge is in progress.
+
+Scaffold pieces:
+pieces = [(source sequence, start in source, end in source, orientation of piece (1 or -1)), ...] in scaffold order. Bases are only copied out when the scaffold is sliced or written.
 
 '''
 
-def process_single(seen, good, assembly, bad, report_list, contigs, ref_start, ref_end, query_start, query_end, ref_align_len, query_align_len, percent_id, ref_len, query_len, ref_coverage, query_coverage, frame, strand, ref_name, query_name, tag):
-    if ref_name not in seen:
-        seen[ref_name]["start"] = []
-        seen[ref_name]["end"] = []
-        
-    if query_coverage == "100.00" and int(query_align_len) == int(query_len):
-        bad[query_name] = 1
-        assembly.pop(query_name, None)
-        contigs.pop(query_name, None)
-        report_list.append(ref_name + "\t" + query_name + "\t" + "covered_100")
-            
+START = 0
+END = 1
+overlap_end_names = ("start", "end")
+
+class ContigNames(object):
+    '''Two-way table between contig names and int ids. Names loaded from the fasta get ids in sorted order; names only seen in the overlap file are appended.'''
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+        self.tables = []
+        self.loaded = 0
+        self.lengths = self.refs()
+    
+    def load(self, names):
+        '''Replaces the table with the sorted names. Ids below loaded are the names loaded from the fasta, and load_assembly fills in their lengths.'''
+        self.names[:] = sorted(set(names))
+        self.ids = dict(izip(self.names, xrange(len(self.names))))
+        self.tables = []
+        self.loaded = len(self.names)
+        self.lengths = self.refs()
+    
+    def id(self, name):
+        '''Returns the id of name, adding it (and growing every table made by flags and refs) if it is new.'''
+        contig_id = self.ids.get(name)
+        if contig_id is None:
+            contig_id = self.ids[name] = len(self.names)
+            self.names.append(intern(name))
+            for table, empty in self.tables:
+                table.append(empty)
+        return contig_id
+    
+    def flags(self):
+        '''Returns a bytearray of zeros with one slot per id.'''
+        table = bytearray(len(self.names))
+        self.tables.append((table, 0))
+        return table
+    
+    def refs(self, typecode="l"):
+        '''Returns an array of -1 with one slot per id.'''
+        table = array(typecode, [-1]) * len(self.names)
+        self.tables.append((table, -1))
+        return table
+    
+    def release(self, *tables):
+        '''Stops growing tables made by flags and refs once they are no longer used, so the table list only holds the tables of the run in progress.'''
+        released = set(map(id, tables))
+        self.tables = [(table, empty) for table, empty in self.tables if id(table) not in released]
+
+contig_names = ContigNames()
+
+class GoodTable(object):
+    '''The good dictionary as parallel arrays indexed by contig id. See Internal data formats.'''
+    __slots__ = ("ref", "ref_end", "query_end", "ori")
+    
+    def __init__(self, names):
+        self.ref = names.refs()
+        self.ref_end = names.flags()
+        self.query_end = names.flags()
+        self.ori = names.refs("b")
+    
+    def set(self, contig, ref, ref_end, query_end, ori):
+        self.ref[contig] = ref
+        self.ref_end[contig] = ref_end
+        self.query_end[contig] = query_end
+        self.ori[contig] = ori
+    
+    def move(self, contig, ref, ori):
+        '''Points the entry of contig at ref, which the contig it pointed at is now part of with orientation ori. The contig keeps its place at an end, so with ori -1 its own ori and ref_end are turned round.'''
+        self.ref[contig] = ref
+        if ori == -1:
+            self.ori[contig] = -self.ori[contig]
+            self.ref_end[contig] = END - self.ref_end[contig]
+    
+    def entry(self, contig):
+        '''Returns the entry for contig in the old list form, [ref_name, "start" or "end", "start" or "end", ori], or None if it is not in good.'''
+        if self.ref[contig] < 0:
+            return None
+        return [contig_names.names[self.ref[contig]], overlap_end_names[self.ref_end[contig]], overlap_end_names[self.query_end[contig]], self.ori[contig]]
+    
+    def contigs(self):
+        '''Returns the ids in good in ascending order.'''
+        return [contig for contig, ref in enumerate(self.ref) if ref >= 0]
+
+class Path(object):
+    '''The member contigs of one output contig in order, each with its orientation in it. reverse only flips a flag and extend links the two paths under a new node, so both take constant time and the members are only listed when written.
+    A node is a contig id, or (member count, first contig, last contig, left node, left ori, right node, right ori). Nodes are never changed, so a path extended into another stays as it was.'''
+    __slots__ = ("node", "ori")
+
+    def __init__(self, node, ori=1):
+        self.node = node
+        self.ori = ori
+
+    def __reduce__(self):
+        return (path_from_members, (list(self.members()),))
+
+    def __len__(self):
+        if isinstance(self.node, tuple):
+            return self.node[0]
+        return 1
+
+    @property
+    def first(self):
+        if not isinstance(self.node, tuple):
+            return self.node
+        return self.node[1] if self.ori == 1 else self.node[2]
+
+    @property
+    def last(self):
+        if not isinstance(self.node, tuple):
+            return self.node
+        return self.node[2] if self.ori == 1 else self.node[1]
+
+    def copy(self):
+        return Path(self.node, self.ori)
+
+    def reverse(self):
+        self.ori = -self.ori
+
+    def extend(self, other):
+        '''Appends the members of other, as they are now, after the members of self.'''
+        self.node = (len(self) + len(other), self.first, other.last, self.node, self.ori, other.node, other.ori)
+        self.ori = 1
+
+    def members(self):
+        '''Yields (contig, ori) for every member in order.'''
+        stack = [(self.node, self.ori)]
+        while stack:
+            node, ori = stack.pop()
+            if not isinstance(node, tuple):
+                yield node, ori
+            elif ori == 1:
+                stack.append((node[5], node[6]))
+                stack.append((node[3], node[4]))
+            else:
+                stack.append((node[3], -node[4]))
+                stack.append((node[5], -node[6]))
+
+    def __iter__(self):
+        for contig, ori in self.members():
+            yield contig
+
+def path_from_members(members):
+    '''Builds a Path from a list of (contig, ori). Pickled paths are rebuilt this way so deep paths don't hit the recursion limit.'''
+    path = None
+    for contig, ori in members:
+        if path is None:
+            path = Path(contig, ori)
+        else:
+            path.extend(Path(contig, ori))
+    return path
+
+_mapped_files = {}
+
+def map_fasta(fasta_file):
+    '''Returns a read-only memory map of fasta_file, shared by every MappedSequence of that file.'''
+    if fasta_file not in _mapped_files:
+        with open(fasta_file, "rb") as f:
+            _mapped_files[fasta_file] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return _mapped_files[fasta_file]
+
+class MappedSequence(object):
+    '''Read-only view of one fasta record in a memory-mapped file. Slicing only reads the bytes that are asked for.'''
+    __slots__ = ("data", "path", "offset", "length", "line_bases", "line_width")
+
+    def __init__(self, path, offset, length, line_bases, line_width):
+        self.data = map_fasta(path)
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.line_bases = line_bases
+        self.line_width = line_width
+
+    def __reduce__(self):
+        return (MappedSequence, (self.path, self.offset, self.length, self.line_bases, self.line_width))
+
+    def __len__(self):
+        return self.length
+
+    def _position(self, i):
+        return self.offset + (i // self.line_bases) * self.line_width + i % self.line_bases
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step != 1:
+                return self[:][key]
+            if stop <= start:
+                return ''
+            seq = self.data[self._position(start):self._position(stop - 1) + 1]
+            if self.line_width != self.line_bases:
+                seq = seq.replace("\n", "").replace("\r", "")
+            return seq
+        if key < 0:
+            key += self.length
+        if key < 0 or key >= self.length:
+            raise IndexError("sequence index out of range")
+        return self.data[self._position(key)]
+
+    def __str__(self):
+        return self[:]
+
+    def __add__(self, other):
+        return self[:] + other
+
+    def __radd__(self, other):
+        return other + self[:]
+
+complement_table = string.maketrans("ACGTUMRWSYKVHDBNacgtumrwsykvhdbn", "TGCAAKYWSRMBDHVNtgcaakywsrmbdhvn")
+
+def reverse_complement(seq):
+    '''Returns the reverse complement of seq in one C-level translate and one reversing slice. IUPAC codes are complemented and lowercase soft-masking is kept.'''
+    return seq.translate(complement_table)[::-1]
+
+class Scaffold(object):
+    '''Merged sequence stored as a list of pieces of its source sequences. Joining and reverse complementing only touch the piece list.'''
+    __slots__ = ("pieces", "length")
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.length = sum([end - start for source, start, end, ori in pieces])
+
+    @staticmethod
+    def join(seqs):
+        pieces = []
+        for seq in seqs:
+            if isinstance(seq, Scaffold):
+                pieces.extend(seq.pieces)
+            elif len(seq) > 0:
+                pieces.append((seq, 0, len(seq), 1))
+        return Scaffold(pieces)
+
+    def reverse_complement(self):
+        pieces = []
+        for source, start, end, ori in reversed(self.pieces):
+            if ori == 1:
+                pieces.append((source, start, end, -1))
+            else:
+                pieces.append((source, start, end, 1))
+        return Scaffold(pieces)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            if key < 0:
+                key += self.length
+            if key < 0 or key >= self.length:
+                raise IndexError("sequence index out of range")
+            return self[key:key + 1]
+        start, stop, step = key.indices(self.length)
+        if step != 1:
+            return self[:][key]
+        seq = []
+        pos = 0
+        for source, piece_start, piece_end, ori in self.pieces:
+            if pos >= stop:
+                break
+            piece_len = piece_end - piece_start
+            a = max(start - pos, 0)
+            b = min(stop - pos, piece_len)
+            if a < b:
+                if ori == 1:
+                    seq.append(source[piece_start + a:piece_start + b])
+                else:
+                    seq.append(reverse_complement(source[piece_end - b:piece_end - a]))
+            pos += piece_len
+        return "".join(seq)
+
+    def __str__(self):
+        return self[:]
+
+    def __add__(self, other):
+        return Scaffold.join([self, other])
+
+    def __radd__(self, other):
+        return Scaffold.join([other, self])
+
+def sequence_chunks(seq, size):
+    '''Yields the bases of seq (str, MappedSequence or Scaffold) in order, in pieces of at most size bases.'''
+    if isinstance(seq, Scaffold):
+        for source, start, end, ori in seq.pieces:
+            for i in xrange(start, end, size):
+                if ori == 1:
+                    yield source[i:min(i + size, end)]
+                else:
+                    j = end - (i - start)
+                    yield reverse_complement(source[max(j - size, start):j])
     else:
-        ref_end_dif = int(ref_len) - int(ref_end)
-        ref_start_dif = int(ref_start)
-        
-        '''
-    seen[ref_name][end of overlap relative to ref] = [len query extension, query_name, seq of extension, end of overlap relative to query, orientation of query to actual ref, actual ref_name to add extension to, which (ref or query) are combined, actual query_name, ori to actual query]
-        '''
-        
-        if strand == "1" and (int(ref_start) < 24 or int(ref_end) > int(ref_len) - 23):
-            end_dif = int(query_len) - int(query_end)
-            start_dif = int(query_start)
-            
-            if end_dif > ref_end_dif:
-                extra_end_seq = assembly[query_name][-(end_dif-ref_end_dif+1):]
-                seen[ref_name]["end"].append([len(extra_end_seq), query_name, extra_end_seq, "start", strand, ref_name, percent_id, query_name, strand])
-                report_list.append("Grabbing sequence in process_single. 1st " + query_name + " " + ref_name)
-            if start_dif > ref_start_dif:
-                extra_start_seq = assembly[query_name][:(start_dif-ref_start_dif)]
-                seen[ref_name]["start"].append([len(extra_start_seq), query_name, extra_start_seq, "end", strand, ref_name, percent_id, query_name, strand])
-                report_list.append("Grabbing sequence in process_single. 2nd"+ " " + query_name + " " + ref_name)
-        elif strand == "-1" and (int(ref_start) < 24 or int(ref_end) > int(ref_len) - 23):
-            end_dif = int(query_end)
-            start_dif = int(query_len) - int(query_start)
-            
-            if end_dif > ref_end_dif:
-                extra_end_seq = fastaIO.reverse_complement(assembly[query_name][:(end_dif - ref_end_dif)])
-                seen[ref_name]["end"].append([len(extra_end_seq), query_name, extra_end_seq, "end", strand, ref_name, percent_id, query_name, strand])
-                report_list.append("Grabbing sequence in process_single. 3rd" + " " + query_name + " " + ref_name)
-            if start_dif > ref_start_dif:
-                extra_start_seq = fastaIO.reverse_complement(assembly[query_name][-(start_dif - ref_start_dif + 1):])
-                seen[ref_name]["start"].append([len(extra_start_seq), query_name, extra_start_seq, "start", strand, ref_name, percent_id, query_name, strand]) 
-                report_list.append("Grabbing sequence in process_single. 4th" + " " + query_name + " " + ref_name)
-        elif float(query_coverage) >= 98.00 and float(percent_id) >= 98.00:
-            bad[query_name] = 1
-            assembly.pop(query_name, None)
-            contigs.pop(query_name, None)
-            report_list.append(ref_name + "\t" + query_name + "\t" + "covered_98")
-    return bad, seen, assembly, good, contigs
+        for i in xrange(0, len(seq), size):
+            yield seq[i:i + size]
+
+class BgzfFile(object):
+    '''Minimal BGZF (blocked gzip) writer. The output is a valid gzip file that samtools faidx can index.'''
+    block_size = 0xff00
+    eof_block = "\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+
+    def __init__(self, path, level=6):
+        self.handle = open(path, "wb")
+        self.level = level
+        self.pending = []
+        self.pending_len = 0
+
+    def write(self, data):
+        self.pending.append(data)
+        self.pending_len += len(data)
+        if self.pending_len >= self.block_size:
+            data = "".join(self.pending)
+            blocks = len(data) // self.block_size
+            for i in xrange(blocks):
+                self._write_block(data[i * self.block_size:(i + 1) * self.block_size])
+            data = data[blocks * self.block_size:]
+            self.pending = [data]
+            self.pending_len = len(data)
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        deflated = compressor.compress(data) + compressor.flush()
+        header = struct.pack("<4BI2BH2BHH", 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord("B"), ord("C"), 2, len(deflated) + 25)
+        trailer = struct.pack("<2I", zlib.crc32(data) & 0xffffffff, len(data))
+        self.handle.write(header + deflated + trailer)
+
+    def close(self):
+        data = "".join(self.pending)
+        if data:
+            self._write_block(data)
+        self.pending = []
+        self.pending_len = 0
+        self.handle.write(self.eof_block)
+        self.handle.close()
+
+GZIP_MAGIC = "\x1f\x8b"
+
+def is_compressed(path):
+    '''True if path is a gzip file (plain or BGZF), whatever its extension.'''
+    with open(path, "rb") as f:
+        return f.read(2) == GZIP_MAGIC
 
-def process_ref_combined(seen, good, assembly, bad, report_list, contigs, ref_start, ref_end, query_start, query_end, ref_align_len, query_align_len, percent_id, ref_len, query_len, ref_coverage, query_coverage, frame, strand, ref_name, query_name, tag):
+def bgzf_blocks(handle):
+    '''Yields the raw deflate data of each block of a BGZF file. Raises IOError at a member that is not a BGZF block.'''
+    while True:
+        header = handle.read(12)
+        if not header:
+            return
+        if len(header) < 12 or header[:2] != GZIP_MAGIC or not ord(header[3]) & 4:
+            raise IOError("Not a BGZF block at offset %d" % (handle.tell() - len(header)))
+        extra = handle.read(struct.unpack("<H", header[10:12])[0])
+        block_size = None
+        i = 0
+        while i + 4 <= len(extra):
+            subfield_len = struct.unpack("<H", extra[i + 2:i + 4])[0]
+            if extra[i:i + 2] == "BC":
+                block_size = struct.unpack("<H", extra[i + 4:i + 6])[0] + 1
+            i += 4 + subfield_len
+        if block_size is None:
+            raise IOError("Not a BGZF block at offset %d" % (handle.tell() - len(header) - len(extra)))
+        data = handle.read(block_size - 12 - len(extra))
+        yield data[:-8]
+
+def is_stream(path):
+    '''True if path is - (stdin) or a pipe or other file that can only be read once, front to back.'''
+    return path == "-" or (os.path.exists(path) and not stat.S_ISREG(os.stat(path).st_mode))
+
+def is_bgzf(path):
+    '''True if path starts with a BGZF block (a gzip member with a BC extra subfield).'''
+    with open(path, "rb") as f:
+        try:
+            return next(bgzf_blocks(f), None) is not None
+        except (IOError, struct.error):
+            return False
+
+def gzip_chunks(handle, size=1 << 20):
+    '''Yields the decompressed data of a plain gzip file, which may hold several members, size compressed bytes at a time.'''
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while True:
+        data = handle.read(size)
+        if not data:
+            break
+        while data:
+            yield decompressor.decompress(data)
+            data = decompressor.unused_data
+            if data:
+                yield decompressor.flush()
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    yield decompressor.flush()
+
+class DecompressedFile(object):
+    '''Read-only line iterator over a gzip or BGZF file, with decompression running ahead of the reader.
+    BGZF blocks are inflated by a pool of threads (zlib lets go of the GIL while it inflates) with up to ahead blocks in flight, and handed over in file order. A plain gzip stream can only be inflated in order, so one background thread does it, up to ahead chunks in front of the reader.'''
+    def __init__(self, path, threads=2, ahead=64, handle=None):
+        '''handle is an open stream to read instead of path. A stream is always inflated in order, as BGZF is also valid plain gzip.'''
+        self.handle = handle or open(path, "rb")
+        self.pool = None
+        if handle is None and is_bgzf(path):
+            self.pool = ThreadPool(max(1, threads))
+            chunks = self._bgzf_chunks(ahead)
+        else:
+            chunks = self._background_chunks(ahead)
+        self.lines = self._lines(chunks)
+    
+    def _bgzf_chunks(self, ahead):
+        pending = deque()
+        for block in bgzf_blocks(self.handle):
+            pending.append(self.pool.apply_async(zlib.decompress, (block, -15)))
+            if len(pending) >= ahead:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    
+    def _background_chunks(self, ahead):
+        chunks = Queue.Queue(ahead)
+        def inflate():
+            try:
+                for chunk in gzip_chunks(self.handle):
+                    chunks.put(chunk)
+                chunks.put(None)
+            except Exception as e:
+                chunks.put(e)
+        thread = threading.Thread(target=inflate)
+        thread.daemon = True
+        thread.start()
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    
+    def _lines(self, chunks):
+        rest = ""
+        for chunk in chunks:
+            lines = (rest + chunk).split("\n")
+            rest = lines.pop()
+            for line in lines:
+                yield line + "\n"
+        if rest:
+            yield rest
+    
+    def __iter__(self):
+        return self.lines
+    
+    def next(self):
+        return next(self.lines)
+    
+    def readline(self):
+        return next(self.lines, "")
     
-    if query_coverage == "100.00" and int(query_align_len) == int(query_len) and float(percent_id) >= 97.9:
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+        self.handle.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+def open_input(path, threads=2):
+    '''Opens an input text file for reading lines, through DecompressedFile if it is gzip or BGZF compressed. - is stdin, and a stream is checked for compression without using up its first bytes.'''
+    if is_stream(path):
+        if path == "-":
+            handle = io.open(sys.stdin.fileno(), "rb", closefd=False)
+        else:
+            handle = io.open(path, "rb")
+        if handle.peek(2)[:2] == GZIP_MAGIC:
+            return DecompressedFile(path, threads, handle=handle)
+        return handle
+    if is_compressed(path):
+        return DecompressedFile(path, threads)
+    return open(path, "r")
+
+class FastaWriter(object):
+    '''Writes fasta records through one large output buffer instead of one write per line, with optional line wrapping and gzip or bgzip compression.'''
+
+    def __init__(self, path, line_width=0, compress="", buffer_size=OUTPUT_BUFFER):
+        if compress == "bgzip":
+            self.handle = BgzfFile(path)
+        elif compress == "gzip":
+            self.handle = gzip.open(path, "wb", 6)
+        else:
+            self.handle = open(path, "wb")
+        self.line_width = line_width
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffer_len = 0
+
+    def _add(self, data):
+        self.buffer.append(data)
+        self.buffer_len += len(data)
+        if self.buffer_len >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.handle.write("".join(self.buffer))
+            self.buffer = []
+            self.buffer_len = 0
+
+    def write(self, title, seq):
+        self._add(">" + title + "\n")
+        width = self.line_width
+        if width <= 0:
+            for chunk in sequence_chunks(seq, self.buffer_size):
+                self._add(chunk)
+            self._add("\n")
+            return
+        column = 0
+        for chunk in sequence_chunks(seq, self.buffer_size):
+            i = 0
+            if column:
+                i = min(width - column, len(chunk))
+                self._add(chunk[:i])
+                column += i
+                if column < width:
+                    continue
+                self._add("\n")
+                column = 0
+            full = i + (len(chunk) - i) // width * width
+            if full > i:
+                self._add("\n".join([chunk[j:j + width] for j in xrange(i, full, width)]) + "\n")
+            if full < len(chunk):
+                self._add(chunk[full:])
+                column = len(chunk) - full
+        if column:
+            self._add("\n")
+
+    def close(self):
+        self.flush()
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+report_events = ("covered_100", "covered_98", "grab", "start_extended", "end_extended", "query_covers_ref", "combined_query_covers_ref", "renamed", "both_ends_short", "start_short", "start_short_in_good", "end_short", "end_short_in_good", "still_in_good", "still_in_good_not_contigs")
+(COVERED_100, COVERED_98, GRAB, START_EXTENDED, END_EXTENDED, QUERY_COVERS_REF, COMBINED_QUERY_COVERS_REF, RENAMED, BOTH_ENDS_SHORT, START_SHORT, START_SHORT_IN_GOOD, END_SHORT, END_SHORT_IN_GOOD, STILL_IN_GOOD, STILL_IN_GOOD_NOT_CONTIGS) = range(len(report_events))
+report_event_levels = [1] * len(report_events)
+report_event_levels[GRAB] = 2
+report_string_values = (GRAB, STILL_IN_GOOD, STILL_IN_GOOD_NOT_CONTIGS)
+report_formats = ("text", "tsv", "binary")
+report_extensions = {"text": ".out", "tsv": ".tsv", "binary": ".bin"}
+report_record = struct.Struct("<B5i")
+REPORT_MAGIC = "ABRP\x01"
+
+'''
+Report events
+
+Every report line is an event (kind, ref, actual_ref, query, combined, value). The contig fields are ids, -1 when unused:
+ref = reference the event is about, actual_ref = contig the reference is merged into, query = query contig, combined = merged contig the query is part of.
+value = extension length for start/end_extended, the overlap case label for grab, "ref end,query end,orientation" for still_in_good*, otherwise 0.
+
+report levels: 0 = no report, 1 = merge results only, 2 = also a grab line for every overlap case taken by process_overlap.
+
+text: the original report lines.
+tsv: one header line, then event, ref, actual_ref, query, combined, value with contig names and empty fields for unused ones.
+binary: REPORT_MAGIC, then one report_record per event with string values replaced by an index into the string table. The file ends with the contig names and the string table (each a uint32 count, then uint32 length and bytes per string) and the uint64 offset of the names. See read_binary_report.
+'''
+
+class ReportWriter(object):
+    '''Streams report events to path as they happen, through one large output buffer. Events above level are dropped before any string is built.'''
+
+    def __init__(self, path, format="text", level=2, buffer_size=OUTPUT_BUFFER, resume=None):
+        self.format = format
+        self.level = level
+        self.handle = None
+        self.strings = {}
+        if level > 0 and resume is not None:
+            offset, self.strings = resume
+            self.handle = open(path, "r+b", buffer_size)
+            self.handle.seek(offset)
+            self.handle.truncate()
+        elif level > 0:
+            self.handle = open(path, "wb", buffer_size)
+            if format == "tsv":
+                self.handle.write("#event\tref\tactual_ref\tquery\tcombined\tvalue\n")
+            elif format == "binary":
+                self.handle.write(REPORT_MAGIC)
+
+    def add(self, kind, ref=-1, actual_ref=-1, query=-1, combined=-1, value=0):
+        if self.level < report_event_levels[kind]:
+            return
+        if self.format == "text":
+            self.handle.write(self.text(kind, ref, actual_ref, query, combined, value))
+        elif self.format == "tsv":
+            names = contig_names.names
+            fields = [report_events[kind]]
+            for contig in (ref, actual_ref, query, combined):
+                fields.append(names[contig] if contig >= 0 else "")
+            fields.append(str(value))
+            self.handle.write("\t".join(fields) + "\n")
+        else:
+            if kind in report_string_values:
+                value = self.strings.setdefault(value, len(self.strings))
+            self.handle.write(report_record.pack(kind, ref, actual_ref, query, combined, value))
+
+    def text(self, kind, ref, actual_ref, query, combined, value):
+        '''Returns the event as the lines of the original text report.'''
+        names = contig_names.names
+        if kind == GRAB:
+            line = "Grabbing sequence in " + value + " " + names[query] + " " + names[ref]
+            if combined >= 0:
+                line += " " + names[combined]
+            if actual_ref >= 0:
+                line += " " + names[actual_ref]
+        elif kind == START_EXTENDED or kind == END_EXTENDED:
+            line = names[ref] + " (" + names[actual_ref] + ")" + "\t" + names[query] + " part of " + names[combined] + "\t" + report_events[kind] + "_" + str(value)
+        elif kind == QUERY_COVERS_REF:
+            line = names[ref] + " (" + names[actual_ref] + ")" + "\t" + names[query] + "\t" + "query covers ref"
+        elif kind == COMBINED_QUERY_COVERS_REF:
+            line = names[ref] + " (" + names[actual_ref] + ")" + "\t" + names[query] + " and " + names[query] + " both in " + names[combined] + "\t" + " Combined query covers ref"
+        elif kind == RENAMED:
+            line = names[ref] + "\t" + names[actual_ref] + "\t" + "actual_ref is not equal to final_ref"
+        elif kind == STILL_IN_GOOD or kind == STILL_IN_GOOD_NOT_CONTIGS:
+            if kind == STILL_IN_GOOD:
+                line = names[query] + "\t" + "Still in good and contigs after processing\n"
+            else:
+                line = names[query] + "\t" + "Still in good but not contigs after processing\n"
+            line += "\n" + str([names[ref]] + value.split(","))
+        elif kind == START_SHORT_IN_GOOD:
+            line = names[ref] + "\t" + names[query] + "\t" + "start_short but contig is in good"
+        elif kind == END_SHORT_IN_GOOD:
+            line = names[ref] + "\t" + names[query] + "\t" + "end_short but contig is in good"
+        else:
+            line = names[ref] + "\t" + names[query] + "\t" + report_events[kind]
+        return line + "\n"
+
+    def checkpoint(self):
+        '''Flushes the report and returns what ReportWriter needs as resume to carry on from here.'''
+        if self.handle is None:
+            return None
+        self.handle.flush()
+        return self.handle.tell(), dict(self.strings)
+
+    def close(self):
+        if self.handle is None:
+            return
+        if self.format == "binary":
+            offset = self.handle.tell()
+            strings = [None] * len(self.strings)
+            for string, i in self.strings.iteritems():
+                strings[i] = string
+            for table in (contig_names.names, strings):
+                self.handle.write(struct.pack("<I", len(table)))
+                for string in table:
+                    self.handle.write(struct.pack("<I", len(string)) + string)
+            self.handle.write(struct.pack("<Q", offset))
+        self.handle.close()
+        self.handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_binary_report(path):
+    '''Yields the events of a binary report with names and string values filled back in.'''
+    with open(path, "rb") as f:
+        if f.read(len(REPORT_MAGIC)) != REPORT_MAGIC:
+            raise ValueError(path + " is not a binary AssemBlender report")
+        f.seek(-8, os.SEEK_END)
+        end = f.tell()
+        offset = struct.unpack("<Q", f.read(8))[0]
+        f.seek(offset)
+        tables = []
+        for i in xrange(2):
+            table = []
+            for j in xrange(struct.unpack("<I", f.read(4))[0]):
+                table.append(f.read(struct.unpack("<I", f.read(4))[0]))
+            tables.append(table)
+        names, strings = tables
+        f.seek(len(REPORT_MAGIC))
+        for i in xrange((offset - len(REPORT_MAGIC)) // report_record.size):
+            kind, ref, actual_ref, query, combined, value = report_record.unpack(f.read(report_record.size))
+            contigs = [names[contig] if contig >= 0 else None for contig in (ref, actual_ref, query, combined)]
+            if kind in report_string_values:
+                value = strings[value]
+            yield tuple([report_events[kind]] + contigs + [value])
+
+def build_fasta_index(fasta_file):
+    '''Scans fasta_file once and returns a list of [name, length, offset, line_bases, line_width] in file order. Records with ragged line lengths get line_bases = -1.'''
+    index = []
+    record = None
+    last_line = 0
+    offset = 0
+    with open(fasta_file, "rb") as f:
+        for line in f:
+            offset += len(line)
+            if line.startswith(">"):
+                record = [line[1:].rstrip(), 0, offset, 0, 0]
+                index.append(record)
+                last_line = 0
+                continue
+            if record is None:
+                continue
+            bases = len(line.rstrip("\r\n"))
+            if record[3] == 0:
+                if bases == 0:
+                    record[2] = offset
+                    continue
+                record[3] = bases
+                record[4] = len(line)
+            elif bases == 0:
+                last_line = 0
+                continue
+            elif last_line != record[3] or bases > record[3] or (bases == record[3] and len(line) != record[4]):
+                record[3] = -1
+            last_line = bases
+            record[1] += bases
+    return index
+
+def read_fasta_index(fasta_file):
+    '''Returns the .fai index for fasta_file, building and saving it first if it is missing or older than the fasta.'''
+    fai_file = fasta_file + ".fai"
+    if os.path.exists(fai_file) and os.path.getmtime(fai_file) >= os.path.getmtime(fasta_file):
+        index = []
+        with open(fai_file, "r") as f:
+            for line in f:
+                name, length, offset, line_bases, line_width = line.rstrip("\n").split("\t")[:5]
+                index.append([name, int(length), int(offset), int(line_bases), int(line_width)])
+        return index
+    index = build_fasta_index(fasta_file)
+    if all(record[3] != -1 for record in index):
+        try:
+            with open(fai_file, "w") as out:
+                for record in index:
+                    out.write("\t".join([str(x) for x in record]) + "\n")
+        except IOError:
+            pass
+    return index
+
+def fasta_records(fasta_file, wanted):
+    '''Yields (name, sequence) for the records of fasta_file in file order, with None for the sequence of names wanted(name) is false for. Only one sequence is held at a time.
+    With a regular line layout each record is read in one piece by its index entry. Compressed and ragged files are parsed line by line.'''
+    index = None if is_compressed(fasta_file) else read_fasta_index(fasta_file)
+    if index is None or any(record[3] == -1 for record in index):
+        with open_input(fasta_file) as f:
+            for title, seq in fastaIO.FastaGeneralIterator(f):
+                yield title, seq if wanted(title) else None
+        return
+    with open(fasta_file, "rb") as f:
+        for name, length, offset, line_bases, line_width in index:
+            if not wanted(name):
+                yield name, None
+            elif length == 0:
+                yield name, ''
+            else:
+                f.seek(offset)
+                lines, rest = divmod(length, line_bases)
+                yield name, f.read(lines * line_width + rest).translate(None, "\r\n")
+
+def load_assembly(fasta_file, only=None):
+    '''Memory-maps fasta_file, loads its names into contig_names and returns the assembly and contigs dictionaries keyed by id. Sequence bytes are only read when a contig is sliced or written.
+    A gzip or BGZF compressed fasta_file can not be mapped, so its sequences are read into memory.
+    If only is given, just the contigs with a name in it are loaded.'''
+    assembly = OrderedDict()
+    contigs = OrderedDict()
+    if is_compressed(fasta_file):
+        with open_input(fasta_file) as f:
+            records = [(title, seq) for title, seq in fastaIO.FastaGeneralIterator(f) if only is None or title in only]
+        contig_names.load([title for title, seq in records])
+        for title, seq in records:
+            contig = contig_names.ids[title]
+            assembly[contig] = seq
+            contigs[contig] = Path(contig)
+            contig_names.lengths[contig] = len(seq)
+        return assembly, contigs
+    index = read_fasta_index(fasta_file)
+    if only is not None:
+        index = [record for record in index if record[0] in only]
+    contig_names.load([record[0] for record in index])
+    if not index:
+        return assembly, contigs
+    ragged = {}
+    if any(record[3] == -1 for record in index):
+        with open(fasta_file, "r") as f:
+            for title, seq in fastaIO.FastaGeneralIterator(f):
+                if only is None or title in only:
+                    ragged[title] = seq
+    for name, length, offset, line_bases, line_width in index:
+        contig = contig_names.ids[name]
+        if line_bases == -1:
+            assembly[contig] = ragged[name]
+        elif length == 0:
+            assembly[contig] = ''
+        else:
+            assembly[contig] = MappedSequence(fasta_file, offset, length, line_bases, line_width)
+        contigs[contig] = Path(contig)
+        contig_names.lengths[contig] = len(assembly[contig])
+    return assembly, contigs
+
+'''
+Overlap cases
+
+Each side of an overlap is a node with two ends: a single contig, or the end contig of a combined one, reached through good with the end it was joined by (good.query_end) and its orientation to the combined contig (good.ori).
+overlap_cases maps (kind, strand, end of ref extended, ref join end, ref ori, query join end, query ori) to how the extension is taken, with None for the join end and ori of a single contig:
+(end of the actual ref it extends, end of overlap relative to query, orientation of query to actual ref, slice bounds of the actual query given the extension length and query_align_len, whether the slice is reverse complemented, grab label)
+The extension is stored in seen as its source sequence and slice bounds; the bases are only read for the extension find_longest_extension picks.
+A key that is not in the table takes nothing. The slices are kept exactly as the original per-kind branch functions had them, and the labels still name those branches.
+'''
+
+SINGLE, REF_COMBINED, QUERY_COMBINED, BOTH_COMBINED = range(4)
+overlap_kind_names = ("process_single", "process_ref_combined", "process_query_combined", "process_both_combined")
+
+overlap_cases = {
+    (SINGLE, 1, END, None, None, None, None): ("end", START, 1, lambda n, q: (-(n + 1), None), False, "process_single. 1st"),
+    (SINGLE, 1, START, None, None, None, None): ("start", END, 1, lambda n, q: (None, n), False, "process_single. 2nd"),
+    (SINGLE, -1, END, None, None, None, None): ("end", END, -1, lambda n, q: (None, n), True, "process_single. 3rd"),
+    (SINGLE, -1, START, None, None, None, None): ("start", START, -1, lambda n, q: (-(n + 1), None), True, "process_single. 4th"),
+    
+    (REF_COMBINED, 1, END, START, 1, None, None): ("end", START, 1, lambda n, q: (n, None), False, "process_ref_combined. 1st"),
+    (REF_COMBINED, 1, END, START, -1, None, None): ("start", START, -1, lambda n, q: (n, None), True, "process_ref_combined. 2nd"),
+    (REF_COMBINED, 1, START, END, 1, None, None): ("start", END, 1, lambda n, q: (None, -n), False, "process_ref_combined. 3rd"),
+    (REF_COMBINED, 1, START, END, -1, None, None): ("end", START, -1, lambda n, q: (None, -n), True, "process_ref_combined. 4th"),
+    (REF_COMBINED, -1, END, START, 1, None, None): ("end", END, -1, lambda n, q: (None, n), True, "process_ref_combined. 5th"),
+    (REF_COMBINED, -1, END, START, -1, None, None): ("start", END, 1, lambda n, q: (None, n), False, "process_ref_combined. 6th"),
+    (REF_COMBINED, -1, START, END, 1, None, None): ("start", END, -1, lambda n, q: (-(n + 1), None), True, "process_ref_combined. 7th"),
+    (REF_COMBINED, -1, START, END, -1, None, None): ("end", START, 1, lambda n, q: (-(n + 1), None), False, "process_ref_combined. 8th"),
+    
+    (QUERY_COMBINED, 1, END, None, None, END, 1): ("end", START, 1, lambda n, q: (n, None), False, "process_query_combined. 1st"),
+    (QUERY_COMBINED, 1, END, None, None, END, -1): ("end", START, 1, lambda n, q: (None, -n), True, "process_query_combined. 2nd"),
+    (QUERY_COMBINED, 1, START, None, None, START, 1): ("start", END, 1, lambda n, q: (None, -q), False, "process_query_combined. 3rd"),
+    (QUERY_COMBINED, 1, START, None, None, START, -1): ("start", END, 1, lambda n, q: (q, None), True, "process_query_combined. 4th"),
+    (QUERY_COMBINED, -1, END, None, None, START, 1): ("end", END, -1, lambda n, q: (None, -n), True, "process_query_combined. 5th"),
+    (QUERY_COMBINED, -1, END, None, None, START, -1): ("end", END, -1, lambda n, q: (n, None), False, "process_query_combined. 6th"),
+    (QUERY_COMBINED, -1, START, None, None, END, 1): ("start", START, -1, lambda n, q: (q, None), True, "process_query_combined. 7th"),
+    (QUERY_COMBINED, -1, START, None, None, END, -1): ("start", START, -1, lambda n, q: (None, -q), False, "process_query_combined. 8th"),
+    
+    (BOTH_COMBINED, 1, END, START, 1, END, 1): ("end", START, 1, lambda n, q: (n, None), False, "process_both_combined. First"),
+    (BOTH_COMBINED, 1, END, START, 1, END, -1): ("end", START, 1, lambda n, q: (None, -n), True, "process_both_combined. Second"),
+    (BOTH_COMBINED, 1, END, START, -1, END, 1): ("start", END, -1, lambda n, q: (None, n), True, "process_both_combined. Third"),
+    (BOTH_COMBINED, 1, END, START, -1, END, -1): ("start", END, -1, lambda n, q: (None, -n), False, "process_both_combined. Fourth"),
+    (BOTH_COMBINED, 1, START, END, 1, START, 1): ("start", START, 1, lambda n, q: (None, -q), False, "process_both_combined. Fifth"),
+    (BOTH_COMBINED, 1, START, END, 1, START, -1): ("start", START, 1, lambda n, q: (q, None), True, "process_both_combined. Sixth"),
+    (BOTH_COMBINED, 1, START, END, -1, START, 1): ("end", START, -1, lambda n, q: (None, -q), True, "process_both_combined. Seventh"),
+    (BOTH_COMBINED, 1, START, END, -1, START, -1): ("end", START, -1, lambda n, q: (q, None), False, "process_both_combined. Eighth"),
+    (BOTH_COMBINED, -1, END, START, 1, START, 1): ("end", END, -1, lambda n, q: (None, -n), True, "process_both_combined. 9th"),
+    (BOTH_COMBINED, -1, END, START, 1, START, -1): ("end", END, -1, lambda n, q: (n, None), False, "process_both_combined. 10th"),
+    (BOTH_COMBINED, -1, END, START, -1, START, 1): ("start", END, 1, lambda n, q: (None, -n), False, "process_both_combined. 11th"),
+    (BOTH_COMBINED, -1, END, START, -1, START, -1): ("start", END, 1, lambda n, q: (n, None), True, "process_both_combined. 12th"),
+    (BOTH_COMBINED, -1, START, END, 1, END, 1): ("start", START, -1, lambda n, q: (q, None), True, "process_both_combined. 13th"),
+    (BOTH_COMBINED, -1, START, END, 1, END, -1): ("start", START, -1, lambda n, q: (None, -q), False, "process_both_combined. 14th"),
+    (BOTH_COMBINED, -1, START, END, -1, END, 1): ("end", START, 1, lambda n, q: (q, None), True, "process_both_combined. 15th"),
+    (BOTH_COMBINED, -1, START, END, -1, END, -1): ("end", START, 1, lambda n, q: (q, None), True, "process_both_combined. 16th"),
+}
+
+def process_overlap(seen, good, assembly, bad, report, contigs, overlap):
+    '''Adds what one overlap can extend its reference by to seen, or drops a query the reference covers. Either side may be a single contig or the end contig of a combined one; see Overlap cases.'''
+    ref_start, ref_end, query_start, query_end, ref_align_len, query_align_len, percent_id, ref_len, query_len, ref_coverage, query_coverage, frame, strand, ref_name, query_name, tag = overlap
+    combined_ref_name = good.ref[ref_name]
+    combined_query_name = good.ref[query_name]
+    kind = (combined_ref_name >= 0) + 2 * (combined_query_name >= 0)
+    if merge_stats is not None:
+        started = time.time()
+    
+    covered = kind <= REF_COMBINED and query_coverage == 100.0 and query_align_len == query_len and (kind == SINGLE or percent_id >= thresholds.covered_identity)
+    if ref_name not in seen and not (covered and kind == REF_COMBINED):
+        seen[ref_name]["start"] = {}
+        seen[ref_name]["end"] = {}
+    if covered:
         bad[query_name] = 1
         assembly.pop(query_name, None)
         contigs.pop(query_name, None)
-        report_list.append(ref_name + "\t" + query_name + "\t" + "covered_100")
-        return bad, seen, assembly, good
-        
-    if ref_name not in seen:
-        seen[ref_name]["start"] = []
-        seen[ref_name]["end"] = []
-
-    combined_ref_name = good[ref_name][0]
-    combined_overlap_end = good[ref_name][1]
-    ref_overlap_end = good[ref_name][2]
-    ref_to_combined_strand = good[ref_name][3]
-            
-    
-    ref_end_dif = int(ref_len) - int(ref_end)
-    ref_start_dif = int(ref_start)
-    if strand == "1" and (int(ref_start) < 24 or int(ref_end) > int(ref_len) - 23):
-        end_dif = int(query_len) - int(query_end)
-        start_dif = int(query_start)
-        '''
-        seen[ref_name][end of overlap relative to ref] = [len query extension, query_name, seq of extension, end of overlap relative to query, orientation of query to actual ref, actual ref_name to add extension to, which (ref or query) are combined, actual query_name, ori to actual query]
-        '''
-        
-        if end_dif > ref_end_dif:
-            if ref_overlap_end == "start" and ref_to_combined_strand == "1":
-                extra_end_seq = assembly[query_name][(end_dif - ref_end_dif):]
-                seen[ref_name]["end"].append([len(extra_end_seq), query_name, extra_end_seq, "start", "1", combined_ref_name, percent_id, query_name, strand])
-                report_list.append("Grabbing sequence in process_ref_combined. 1st" + " " + query_name + " " + ref_name + " " + combined_ref_name)
-            elif ref_overlap_end == "start" and ref_to_combined_strand == "-1":
-                extra_end_seq = fastaIO.reverse_complement(assembly[query_name][(end_dif - ref_end_dif):])
-                seen[ref_name]["start"].append([len(extra_end_seq), query_name, extra_end_seq, "start", "-1", combined_ref_name, percent_id, query_name, strand])
-                report_list.append("Grabbing sequence in process_ref_combined. 2nd" + " " + query_name + " " + ref_name + " " + combined_ref_name)
-                
-        if start_dif > ref_start_dif:
-            if ref_overlap_end == "end" and ref_to_combined_strand == "1":
-                extra_start_seq = assembly[query_name][:-(start_dif - ref_start_dif)]
-                seen[ref_name]["start"].append([len(extra_start_seq), query_name, extra_start_seq, "end", "1", combined_ref_name, percent_id, query_name, strand])
-                report_list.append("Grabbing sequence in process_ref_combined. 3rd" + " " + query_name + " " + ref_name + " " + combined_ref_name)
-            elif ref_overlap_end == "end" and ref_to_combined_strand == "-1":
-                extra_start_seq = fastaIO.reverse_complement(assembly[query_name][:-(start_dif - ref_start_dif)])
-                seen[ref_name]["end"].append([len(extra_start_seq), query_name, extra_start_seq, "start", "-1", combined_ref_name, percent_id, query_name, strand])
-                report_list.append("Grabbing sequence in process_ref_combined. 4th" + " " + query_name + " " + ref_name + " " + combined_ref_name)
-                
-    elif strand == "-1" and (int(ref_start) < 24 or int(ref_end) > int(ref_len) - 23):
-        end_dif = int(query_end)
-        start_dif = int(query_len) - int(query_start)
+        report.add(COVERED_100, ref_name, -1, query_name)
+    elif ref_start < thresholds.start_window or ref_end > ref_len - thresholds.end_window:
+        if strand == 1:
+            end_dif = query_len - query_end
+            start_dif = query_start
+        else:
+            end_dif = query_end
+            start_dif = query_len - query_start
+        if combined_ref_name >= 0:
+            actual_ref = combined_ref_name
+            ref_join = (good.query_end[ref_name], good.ori[ref_name])
+        else:
+            actual_ref = ref_name
+            ref_join = (None, None)
+        if combined_query_name >= 0:
+            actual_query = combined_query_name
+            query_join = (good.query_end[query_name], good.ori[query_name])
+            actual_query_ori = good.ori[query_name]
+        else:
+            actual_query = query_name
+            query_join = (None, None)
+            actual_query_ori = strand
         
-        if end_dif > ref_end_dif:
-            if ref_overlap_end == "start" and ref_to_combined_strand == "1":
-                extra_end_seq = fastaIO.reverse_complement(assembly[query_name][:(end_dif - ref_end_dif)])
-                seen[ref_name]["end"].append([len(extra_end_seq), query_name, extra_end_seq, "end", "-1", combined_ref_name, percent_id, query_name, strand])
-                report_list.append("Grabbing sequence in process_ref_combined. 5th" + " " + query_name + " " + ref_name + " " + combined_ref_name)
-            elif ref_overlap_end == "start" and ref_to_combined_strand == "-1":
-                extra_end_seq = assembly[query_name][:(end_dif - ref_end_dif)]
-                seen[ref_name]["start"].append([len(extra_end_seq), query_name, extra_end_seq, "end", "1", combined_ref_name, percent_id, query_name, strand])
-                report_list.append("Grabbing sequence in process_ref_combined. 6th" + " " + query_name + " " + ref_name + " " + combined_ref_name)
-                    
-        if start_dif > ref_start_dif:
-            if ref_overlap_end == "end" and ref_to_combined_strand == "1":
-                extra_start_seq = fastaIO.reverse_complement(assembly[query_name][-(start_dif - ref_start_dif + 1):])
-                seen[ref_name]["start"].append([len(extra_start_seq), query_name, extra_start_seq, "end", "-1", combined_ref_name, percent_id, query_name, strand])
-                report_list.append("Grabbing sequence in process_ref_combined. 7th" + " " + query_name + " " + ref_name + " " + combined_ref_name)
-            elif ref_overlap_end == "end" and ref_to_combined_strand == "-1":
-                extra_start_seq = assembly[query_name][-(start_dif - ref_start_dif + 1):]
-                seen[ref_name]["end"].append([len(extra_start_seq), query_name, extra_start_seq, "start", "1", combined_ref_name, percent_id, query_name, strand])
-                report_list.append("Grabbing sequence in process_ref_combined. 8th" + " " + query_name + " " + ref_name + " " + combined_ref_name)
-    elif float(query_coverage) >= 98.00 and float(percent_id) >= 98.00:
+        for extended_end, extension in ((END, end_dif - (ref_len - ref_end)), (START, start_dif - ref_start)):
+            if extension <= 0:
+                continue
+            case = overlap_cases.get((kind, strand, extended_end) + ref_join + query_join)
+            if case is None:
+                continue
+            seen_end, overlap_end, ori, bounds, complement, label = case
+            source = assembly[actual_query]
+            start, stop, step = slice(*bounds(extension, query_align_len)).indices(len(source))
+            extra = (source, start, stop, -1 if complement else 1)
+            add_extension(seen[ref_name][seen_end], (max(stop - start, 0), query_name, extra, overlap_end, ori, actual_ref, percent_id, actual_query, actual_query_ori))
+            report.add(GRAB, ref_name, combined_ref_name, query_name, combined_query_name, label)
+            if merge_stats is not None:
+                merge_stats.cases[label] = merge_stats.cases.get(label, 0) + 1
+    elif kind <= REF_COMBINED and query_coverage >= thresholds.near_coverage and percent_id >= thresholds.near_identity:
         bad[query_name] = 1
         assembly.pop(query_name, None)
         contigs.pop(query_name, None)
-        report_list.append(ref_name + "\t" + query_name + "\t" + "covered_98")
-    return bad, seen, assembly, good
-
-def process_query_combined(seen, good, assembly, bad, report_list, contigs, ref_start, ref_end, query_start, query_end, ref_align_len, query_align_len, percent_id, ref_len, query_len, ref_coverage, query_coverage, frame, strand, ref_name, query_name, tag):
-    if ref_name not in seen:
-        seen[ref_name]["start"] = []
-        seen[ref_name]["end"] = []
-    
-    combined_query_name = good[query_name][0]
-    combined_overlap_end = good[query_name][1]
-    query_overlap_end = good[query_name][2]
-    query_to_combined_strand = good[query_name][3]
-            
-    
-    ref_end_dif = int(ref_len) - int(ref_end)
-    ref_start_dif = int(ref_start)
-    if strand == "1" and (int(ref_start) < 24 or int(ref_end) > int(ref_len) - 23):
-        end_dif = int(query_len) - int(query_end)
-        start_dif = int(query_start)
-        
-        '''
-        seen[ref_name][end of overlap relative to ref] = [len query extension, query_name, seq of extension, end of overlap relative to query, orientation of query to actual ref, actual ref_name to add extension to, which (ref or query) are combined, actual query_name, ori to actual query]
-        '''
-        
-        if end_dif > ref_end_dif:
-            if query_overlap_end == "end" and query_to_combined_strand == "1":
-                extra_end_seq = assembly[combined_query_name][(end_dif - ref_end_dif):]
-                seen[ref_name]["end"].append([len(extra_end_seq), query_name, extra_end_seq, "start", "1", ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                report_list.append("Grabbing sequence in process_query_combined. 1st" + " " + query_name + " " + ref_name + " " + combined_query_name)
-            elif query_overlap_end == "end" and query_to_combined_strand == "-1":
-                extra_end_seq = fastaIO.reverse_complement(assembly[combined_query_name][:-(end_dif - ref_end_dif)])
-                seen[ref_name]["end"].append([len(extra_end_seq), query_name, extra_end_seq, "start", "1", ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                report_list.append("Grabbing sequence in process_query_combined. 2nd" + " " + query_name + " " + ref_name + " " + combined_query_name)
-        if start_dif > ref_start_dif:
-            if query_overlap_end == "start" and query_to_combined_strand == "1":
-                extra_start_seq = assembly[combined_query_name][:-int(query_align_len)]
-                seen[ref_name]["start"].append([len(extra_start_seq), query_name, extra_start_seq, "end", "1", ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                report_list.append("Grabbing sequence in process_query_combined. 3rd" + " " + query_name + " " + ref_name + " " + combined_query_name)
-            elif query_overlap_end == "start" and query_to_combined_strand == "-1":
-                extra_start_seq = fastaIO.reverse_complement(assembly[combined_query_name][int(query_align_len):])
-                seen[ref_name]["start"].append([len(extra_start_seq), query_name, extra_start_seq, "end", "1", ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                report_list.append("Grabbing sequence in process_query_combined. 4th" + " " + query_name + " " + ref_name + " " + combined_query_name)
-    elif strand == "-1" and (int(ref_start) < 24 or int(ref_end) > int(ref_len) - 23):
-        end_dif = int(query_end)
-        start_dif = int(query_len) - int(query_start)
-        
-        if end_dif > ref_end_dif:
-            if query_overlap_end == "start" and query_to_combined_strand == "1":
-                try:
-                    extra_end_seq = fastaIO.reverse_complement(assembly[combined_query_name][:-(end_dif - ref_end_dif)])
-                except:
-                    print "Error with assembly. Info:\n", "\t".join([ref_start, ref_end, query_start, query_end, ref_align_len, query_align_len, percent_id, ref_len, query_len, ref_coverage, query_coverage, frame, strand, ref_name, query_name, tag])
-                    raise
-                seen[ref_name]["end"].append([len(extra_end_seq), query_name, extra_end_seq, "end", "-1", ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                report_list.append("Grabbing sequence in process_query_combined. 5th" + " " + query_name + " " + ref_name + " " + combined_query_name)
-            elif query_overlap_end == "start" and query_to_combined_strand == "-1":
-                extra_end_seq = assembly[combined_query_name][(end_dif - ref_end_dif):]
-                seen[ref_name]["end"].append([len(extra_end_seq), query_name, extra_end_seq, "end", "-1", ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                report_list.append("Grabbing sequence in process_query_combined. 6th" + " " + query_name + " " + ref_name + " " + combined_query_name)
-        if start_dif > ref_start_dif:
-            if query_overlap_end == "end" and query_to_combined_strand == "1":
-                extra_start_seq = fastaIO.reverse_complement(assembly[combined_query_name][int(query_align_len):])
-                seen[ref_name]["start"].append([len(extra_start_seq), query_name, extra_start_seq, "start", "-1", ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                report_list.append("Grabbing sequence in process_query_combined. 7th" + " " + query_name + " " + ref_name + " " + combined_query_name)
-            elif query_overlap_end == "end" and query_to_combined_strand == "-1":
-                try:
-                    extra_start_seq = assembly[combined_query_name][:-int(query_align_len)]
-                except:
-                    print "Combined query missing from assembly. ref_name and query_name :", query_name, ref_name
-                    raise
-                seen[ref_name]["start"].append([len(extra_start_seq), query_name, extra_start_seq, "start", "-1", ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                report_list.append("Grabbing sequence in process_query_combined. 8th" + " " + query_name + " " + ref_name + " " + combined_query_name)
-    return bad, seen, assembly, good
-
-def process_both_combined(seen, good, assembly, bad, report_list, contigs, ref_start, ref_end, query_start, query_end, ref_align_len, query_align_len, percent_id, ref_len, query_len, ref_coverage, query_coverage, frame, strand, ref_name, query_name, tag):
-    if ref_name not in seen:
-        seen[ref_name]["start"] = []
-        seen[ref_name]["end"] = []
-    
-    combined_ref_name = good[ref_name][0]
-    combined_ref_overlap_end = good[ref_name][1]
-    ref_overlap_end = good[ref_name][2]
-    ref_to_combined_strand = good[ref_name][3]
-    
-    combined_query_name = good[query_name][0]
-    combined_query_overlap_end = good[query_name][1]
-    query_overlap_end = good[query_name][2]
-    query_to_combined_strand = good[query_name][3]
-    
-    ref_end_dif = int(ref_len) - int(ref_end)
-    ref_start_dif = int(ref_start)
-    if strand == "1" and (int(ref_start) < 24 or int(ref_end) > int(ref_len) - 23):
-        end_dif = int(query_len) - int(query_end)
-        start_dif = int(query_start)
-        
-        '''
-        seen[ref_name][end of overlap relative to ref] = [len query extension, query_name, seq of extension, end of overlap relative to query, orientation of query to actual ref, actual ref_name to add extension to, which (ref or query) are combined, actual query_name, ori to actual query]
-        '''
-        
-        if end_dif > ref_end_dif:
-            if ref_overlap_end == "start" and query_overlap_end == "end" and ref_to_combined_strand == "1":
-                if query_to_combined_strand == "1":
-                    extra_end_seq = assembly[combined_query_name][(end_dif - ref_end_dif):]
-                    seen[ref_name]["end"].append([len(extra_end_seq), query_name, extra_end_seq, "start", "1", combined_ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                    report_list.append("Grabbing sequence in process_both_combined. First" + " " + query_name + " " + ref_name + " " + combined_query_name + " " + combined_ref_name)                    
-                else:
-                    extra_end_seq = fastaIO.reverse_complement(assembly[combined_query_name][:-(end_dif - ref_end_dif)])
-                    seen[ref_name]["end"].append([len(extra_end_seq), query_name, extra_end_seq, "start", "1", combined_ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                    report_list.append("Grabbing sequence in process_both_combined. Second" + " " + query_name + " " + ref_name + " " + combined_query_name + " " + combined_ref_name)
-                    
-            elif ref_overlap_end == "start" and query_overlap_end == "end" and ref_to_combined_strand == "-1":
-                if query_to_combined_strand == "1":
-                    extra_end_seq = fastaIO.reverse_complement(assembly[combined_query_name][:(end_dif - ref_end_dif)])
-                    seen[ref_name]["start"].append([len(extra_end_seq), query_name, extra_end_seq, "end", "-1", combined_ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                    report_list.append("Grabbing sequence in process_both_combined. Third" + " " + query_name + " " + ref_name + " " + combined_query_name + " " + combined_ref_name)
-                else:
-                    extra_end_seq = assembly[combined_query_name][:-(end_dif - ref_end_dif)]
-                    seen[ref_name]["start"].append([len(extra_end_seq), query_name, extra_end_seq, "end", "-1", combined_ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                    report_list.append("Grabbing sequence in process_both_combined. Fourth" + " " + query_name + " " + ref_name + " " + combined_query_name + " " + combined_ref_name)
-        if start_dif > ref_start_dif:
-            if ref_overlap_end == "end" and query_overlap_end == "start" and ref_to_combined_strand == "1":
-                if query_to_combined_strand == "1":
-                    extra_start_seq = assembly[combined_query_name][:-int(query_align_len)]
-                    seen[ref_name]["start"].append([len(extra_start_seq), query_name, extra_start_seq, "start", "1", combined_ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                    report_list.append("Grabbing sequence in process_both_combined. Fifth" + " " + query_name + " " + ref_name + " " + combined_query_name + " " + combined_ref_name)
-                else:
-                    extra_start_seq = fastaIO.reverse_complement(assembly[combined_query_name][int(query_align_len):])
-                    seen[ref_name]["start"].append([len(extra_start_seq), query_name, extra_start_seq, "start", "1", combined_ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                    report_list.append("Grabbing sequence in process_both_combined. Sixth" + " " + query_name + " " + ref_name + " " + combined_query_name + " " + combined_ref_name)
-            elif ref_overlap_end == "end" and query_overlap_end == "start" and ref_to_combined_strand == "-1":
-                if query_to_combined_strand == "1":
-                    extra_start_seq = fastaIO.reverse_complement(assembly[combined_query_name][:-int(query_align_len)])
-                    seen[ref_name]["end"].append([len(extra_start_seq), query_name, extra_start_seq, "start", "-1", combined_ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                    report_list.append("Grabbing sequence in process_both_combined. Seventh" + " " + query_name + " " + ref_name + " " + combined_query_name + " " + combined_ref_name)
-                else:
-                    extra_start_seq = assembly[combined_query_name][int(query_align_len):]
-                    seen[ref_name]["end"].append([len(extra_start_seq), query_name, extra_start_seq, "start", "-1", combined_ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                    report_list.append("Grabbing sequence in process_both_combined. Eighth" + " " + query_name + " " + ref_name + " " + combined_query_name + " " + combined_ref_name)
-    elif strand == "-1" and (int(ref_start) < 24 or int(ref_end) > int(ref_len) - 23):
-        end_dif = int(query_end)
-        start_dif = int(query_len) - int(query_start)
-        
-        '''
-        seen[ref_name][end of overlap relative to ref] = [len query extension, query_name, seq of extension, end of overlap relative to query, orientation of query to actual ref, actual ref_name to add extension to, which (ref or query) are combined, actual query_name, ori to actual query]
-        '''
-        
-        if end_dif > ref_end_dif:
-            if ref_overlap_end == "start" and query_overlap_end == "start" and ref_to_combined_strand == "1":
-                if query_to_combined_strand == "1":
-                    extra_end_seq = fastaIO.reverse_complement(assembly[combined_query_name][:-(end_dif - ref_end_dif)])
-                    seen[ref_name]["end"].append([len(extra_end_seq), query_name, extra_end_seq, "end", "-1", combined_ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                    report_list.append("Grabbing sequence in process_both_combined. 9th" + " " + query_name + " " + ref_name + " " + combined_query_name + " " + combined_ref_name)
-                else:
-                    extra_end_seq = assembly[combined_query_name][(end_dif - ref_end_dif):]
-                    seen[ref_name]["end"].append([len(extra_end_seq), query_name, extra_end_seq, "end", "-1", combined_ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                    report_list.append("Grabbing sequence in process_both_combined. 10th" + " " + query_name + " " + ref_name + " " + combined_query_name + " " + combined_ref_name)
-            elif ref_overlap_end == "start" and query_overlap_end == "start" and ref_to_combined_strand == "-1":
-                if query_to_combined_strand == "1":
-                    extra_end_seq = assembly[combined_query_name][:-(end_dif - ref_end_dif)]
-                    seen[ref_name]["start"].append([len(extra_end_seq), query_name, extra_end_seq, "end", "1", combined_ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                    report_list.append("Grabbing sequence in process_both_combined. 11th" + " " + query_name + " " + ref_name + " " + combined_query_name + " " + combined_ref_name)
-                else:
-                    extra_end_seq = fastaIO.reverse_complement(assembly[combined_query_name][(end_dif - ref_end_dif):])
-                    seen[ref_name]["start"].append([len(extra_end_seq), query_name, extra_end_seq, "end", "1", combined_ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                    report_list.append("Grabbing sequence in process_both_combined. 12th" + " " + query_name + " " + ref_name + " " + combined_query_name + " " + combined_ref_name)
-                    
-        if start_dif > ref_start_dif:
-            if ref_overlap_end == "end" and query_overlap_end == "end" and ref_to_combined_strand == "1":
-                if query_to_combined_strand == "1":
-                    extra_start_seq = fastaIO.reverse_complement(assembly[combined_query_name][int(query_align_len):])
-                    seen[ref_name]["start"].append([len(extra_start_seq), query_name, extra_start_seq, "start", "-1", combined_ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                    report_list.append("Grabbing sequence in process_both_combined. 13th" + " " + query_name + " " + ref_name + " " + combined_query_name + " " + combined_ref_name)
-                else:
-                    extra_start_seq = assembly[combined_query_name][:-int(query_align_len)]
-                    seen[ref_name]["start"].append([len(extra_start_seq), query_name, extra_start_seq, "start", "-1", combined_ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                    report_list.append("Grabbing sequence in process_both_combined. 14th" + " " + query_name + " " + ref_name + " " + combined_query_name + " " + combined_ref_name)
-            elif ref_overlap_end == "end" and query_overlap_end == "end" and ref_to_combined_strand == "-1":
-                if query_to_combined_strand == "1":
-                    extra_start_seq = fastaIO.reverse_complement(assembly[combined_query_name][int(query_align_len):])
-                    seen[ref_name]["end"].append([len(extra_start_seq), query_name, extra_start_seq, "start", "1", combined_ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                    report_list.append("Grabbing sequence in process_both_combined. 15th" + " " + query_name + " " + ref_name + " " + combined_query_name + " " + combined_ref_name)
-                else:
-                    extra_start_seq = fastaIO.reverse_complement(assembly[combined_query_name][int(query_align_len):])
-                    seen[ref_name]["end"].append([len(extra_start_seq), query_name, extra_start_seq, "start", "1", combined_ref_name, percent_id, combined_query_name, query_to_combined_strand])
-                    report_list.append("Grabbing sequence in process_both_combined. 16th" + " " + query_name + " " + ref_name + " " + combined_query_name + " " + combined_ref_name)
-    return bad, seen, assembly, good
+        report.add(COVERED_98, ref_name, -1, query_name)
+    if merge_stats is not None:
+        merge_stats.kind_calls[kind] += 1
+        merge_stats.kind_seconds[kind] += time.time() - started
+    return bad, seen, assembly, good, contigs
+
+extension_order = count()
+
+def add_extension(candidates, extension):
+    '''Adds a seen extension to the candidates of one reference end, a dictionary of query_id: (hit order, extension) holding the best hit of each query.
+    A new hit replaces the query's old one if its identity is higher, or equal with an extension at least as long. The query keeps the place in the hit order of its first hit.'''
+    old = candidates.get(extension[1])
+    if old is None:
+        candidates[extension[1]] = (next(extension_order), extension)
+    elif extension[6] > old[1][6] or (extension[6] == old[1][6] and extension[0] >= old[1][0]):
+        candidates[extension[1]] = (old[0], extension)
+
+def extension_seq(extension):
+    '''Returns the bases of a seen extension. Only the chosen extension at each end is ever read out of its source.'''
+    source, start, stop, strand = extension[2]
+    if strand == -1:
+        return reverse_complement(source[start:stop])
+    return source[start:stop]
+
+def extension_heap(candidates):
+    '''Returns the candidates of one reference end in seen as a heap with the longest extension on top. Equal lengths keep hit order.'''
+    heap = [(-extension[0], order, extension) for order, extension in candidates.itervalues()]
+    heapq.heapify(heap)
+    return heap
+
+def best_extension(heap, bad):
+    '''Pops extensions off heap until one whose query is not in bad turns up. Returns it in a one item list, or an empty list if there is none.'''
+    while heap:
+        extension = heapq.heappop(heap)[2]
+        if not bad[extension[1]]:
+            return [extension]
+    return []
 
-def find_longest_extension(seen, good, bad, report_list, assembly, last_ref, contigs, covers, processed):
+def remaining_extensions(heap):
+    '''Empties heap and returns what was left in it, longest first.'''
+    heap.sort()
+    extensions = [item[2] for item in heap]
+    del heap[:]
+    return extensions
+
+def absorb_far_end(good, contigs, extension, actual_ref):
+    '''Called when the combined query of a seen extension is joined onto actual_ref by its end contig. Points the good entry of the combined query's other end contig at actual_ref, as that contig is now an end of actual_ref.
+    Only the two end contigs of a combined contig are in good, so moving this one entry as each merge happens keeps every lookup through good a single step.'''
+    joined = extension[1]
+    combined = extension[7]
+    if joined == combined or combined not in contigs:
+        return
+    members = contigs[combined]
+    far_end = members.first if members.last == joined else members.last
+    if far_end != joined and good.ref[far_end] == combined:
+        good.move(far_end, actual_ref, extension[4] * extension[8])
+
+def find_longest_extension(seen, good, bad, report, assembly, last_ref, contigs, covers, processed):
+    names = contig_names.names
     final_name_list = []
     final_name_dict = {}
-    if last_ref in good:
-        actual_ref = good[last_ref][0]
-    elif last_ref in covers:
+    if good.ref[last_ref] >= 0:
+        actual_ref = good.ref[last_ref]
+    elif covers[last_ref] >= 0:
         actual_ref = covers[last_ref]
-        covers.pop(last_ref, None)
+        covers[last_ref] = -1
     else:
         actual_ref = last_ref
-    if actual_ref in assembly and actual_ref not in bad:
+    if actual_ref in assembly and not bad[actual_ref]:
         if actual_ref != last_ref:
-            final_name_dict[actual_ref] = good[last_ref][3]
+            final_name_dict[actual_ref] = good.ori[last_ref]
         else:
-            final_name_dict[actual_ref] = "1"
+            final_name_dict[actual_ref] = 1
         final_name_list.append(actual_ref)
         start_seq = ''
         end_seq = ''
         pop = 0
-        if last_ref in bad:
-            print "Last ref", last_ref, "is in bad. Top"
-        if actual_ref in bad:
-            print "Actual ref", actual_ref, "is in bad. Top"
+        if bad[last_ref]:
+            print "Last ref", names[last_ref], "is in bad. Top"
+        if bad[actual_ref]:
+            print "Actual ref", names[actual_ref], "is in bad. Top"
         
-        #sort overlap lists
-        if len(seen[last_ref]["start"]) > 0:            
-            seen[last_ref]["start"].sort(key=itemgetter(0), reverse=True)
-            while len(seen[last_ref]["start"]) > 0 and seen[last_ref]["start"][0][1] in bad:
-                seen[last_ref]["start"].pop(0)
-            if len(seen[last_ref]["start"]) > 0:
-                start_seq = seen[last_ref]["start"][0][2]
-                report_list.append(last_ref + " (" + actual_ref + ")"+ "\t" + seen[last_ref]["start"][0][1] + " part of " + seen[last_ref]["start"][0][7] + "\t" + "start_extended_" + str(seen[last_ref]["start"][0][0]))
-                pop += 1 
-                if seen[last_ref]["start"][0][5] not in final_name_dict:
-                    final_name_dict[seen[last_ref]["start"][0][5]] = "1"
-                    final_name_list.append(seen[last_ref]["start"][0][5])
-                if seen[last_ref]["start"][0][7] not in final_name_dict:    
-                    if seen[last_ref]["start"][0][4] == "1":
-                        if seen[last_ref]["start"][0][8] == "1":
-                            final_name_dict[seen[last_ref]["start"][0][7]] = "1"
-                        else:
-                            final_name_dict[seen[last_ref]["start"][0][7]] = "-1"
+        #pick the longest extension at each end, the shorter ones stay in the heaps
+        start_heap = extension_heap(seen[last_ref]["start"])
+        seen[last_ref]["start"] = best_extension(start_heap, bad)
+        if len(seen[last_ref]["start"]) > 0:
+            start_seq = extension_seq(seen[last_ref]["start"][0])
+            report.add(START_EXTENDED, last_ref, actual_ref, seen[last_ref]["start"][0][1], seen[last_ref]["start"][0][7], seen[last_ref]["start"][0][0])
+            pop += 1 
+            if seen[last_ref]["start"][0][5] not in final_name_dict:
+                final_name_dict[seen[last_ref]["start"][0][5]] = 1
+                final_name_list.append(seen[last_ref]["start"][0][5])
+            if seen[last_ref]["start"][0][7] not in final_name_dict:    
+                if seen[last_ref]["start"][0][4] == 1:
+                    if seen[last_ref]["start"][0][8] == 1:
+                        final_name_dict[seen[last_ref]["start"][0][7]] = 1
                     else:
-                        if seen[last_ref]["start"][0][8] == "-1":
-                            final_name_dict[seen[last_ref]["start"][0][7]] = "1"
-                        else:
-                            final_name_dict[seen[last_ref]["start"][0][7]] = "-1"
-                    final_name_list.append(seen[last_ref]["start"][0][7])
-                if seen[last_ref]["start"][0][1] == 'A1_contig00078.001':
-                    print "A1_contig00078.001 is longest for start."
+                        final_name_dict[seen[last_ref]["start"][0][7]] = -1
+                else:
+                    if seen[last_ref]["start"][0][8] == -1:
+                        final_name_dict[seen[last_ref]["start"][0][7]] = 1
+                    else:
+                        final_name_dict[seen[last_ref]["start"][0][7]] = -1
+                final_name_list.append(seen[last_ref]["start"][0][7])
+            if names[seen[last_ref]["start"][0][1]] == 'A1_contig00078.001':
+                print "A1_contig00078.001 is longest for start."
         
-        if len(seen[last_ref]["end"]) > 0:            
-            seen[last_ref]["end"].sort(key=itemgetter(0), reverse=True)
-            while len(seen[last_ref]["end"]) > 0 and seen[last_ref]["end"][0][1] in bad:
-                seen[last_ref]["end"].pop(0)
-            if len(seen[last_ref]["end"]) > 0:
-                end_seq = seen[last_ref]["end"][0][2]
-                report_list.append(last_ref + " (" + actual_ref + ")"+ "\t" + seen[last_ref]["end"][0][1] + " part of " + seen[last_ref]["end"][0][7] + "\t" + "end_extended_" + str(seen[last_ref]["end"][0][0]))
-                pop += 2
-                if seen[last_ref]["end"][0][7] not in final_name_dict:
-                    if seen[last_ref]["end"][0][4] == "1":
-                        if seen[last_ref]["end"][0][8] == "1":
-                            final_name_dict[seen[last_ref]["end"][0][7]] = "1"
-                        else:
-                            final_name_dict[seen[last_ref]["end"][0][7]] = "-1"
+        end_heap = extension_heap(seen[last_ref]["end"])
+        seen[last_ref]["end"] = best_extension(end_heap, bad)
+        if len(seen[last_ref]["end"]) > 0:
+            end_seq = extension_seq(seen[last_ref]["end"][0])
+            report.add(END_EXTENDED, last_ref, actual_ref, seen[last_ref]["end"][0][1], seen[last_ref]["end"][0][7], seen[last_ref]["end"][0][0])
+            pop += 2
+            if seen[last_ref]["end"][0][7] not in final_name_dict:
+                if seen[last_ref]["end"][0][4] == 1:
+                    if seen[last_ref]["end"][0][8] == 1:
+                        final_name_dict[seen[last_ref]["end"][0][7]] = 1
                     else:
-                        if seen[last_ref]["end"][0][8] == "-1":
-                            final_name_dict[seen[last_ref]["end"][0][7]] = "1"
-                        else:
-                            final_name_dict[seen[last_ref]["end"][0][7]] = "-1"
-                    final_name_list.append(seen[last_ref]["end"][0][7])
+                        final_name_dict[seen[last_ref]["end"][0][7]] = -1
+                else:
+                    if seen[last_ref]["end"][0][8] == -1:
+                        final_name_dict[seen[last_ref]["end"][0][7]] = 1
+                    else:
+                        final_name_dict[seen[last_ref]["end"][0][7]] = -1
+                final_name_list.append(seen[last_ref]["end"][0][7])
 
             
         if pop == 0:
             seen = Vividict()
-            last_ref = ''
+            last_ref = -1
             return seen, assembly, good, bad, last_ref, contigs, covers, processed
         final_name_list.sort()
         final_name = final_name_list.pop(0)
         
-        '''        
-    seen dictionary:
-    seen[ref_name][end of overlap relative to ref] = [len query extension, query_name, seq of extension, end of overlap relative to query, orientation of query to actual ref, actual ref_name to add extension to, which (ref or query) are combined, actual query_name, ori to actual query]
-    
-    good dictionary:
-    good[best_query_contig] = [ref_contig, end of ref_contig extended, end of query_contig used in extension, orientation of query to final orientation (either just to ref if it's a single contig or to the orientation of merged contigs)]
-        '''
+        # seen, good and the other tables are laid out as in Internal data formats at the top of the file.
             
         if pop == 3:
             if seen[last_ref]["start"][0][1] == seen[last_ref]["end"][0][1] and seen[last_ref]["start"][0][7] == seen[last_ref]["start"][0][1] and seen[last_ref]["end"][0][7] == seen[last_ref]["end"][0][1]:
                 if last_ref != seen[last_ref]["start"][0][5]:
-                    print "Problem: last_ref is not equal to actual_ref in seen even though the query covers the ref. Last_ref=", last_ref, "actual_ref in seen=", seen[last_ref]["start"][0][5] 
+                    print "Problem: last_ref is not equal to actual_ref in seen even though the query covers the ref. Last_ref=", names[last_ref], "actual_ref in seen=", names[seen[last_ref]["start"][0][5]] 
                 covers[seen[last_ref]["start"][0][1]] = actual_ref
-                report_list.append(last_ref + " (" + actual_ref + ")"+ "\t" + seen[last_ref]["start"][0][1] + "\t" + "query covers ref")
-                contigs[actual_ref] = contigs[seen[last_ref]["start"][0][1]]
+                report.add(QUERY_COVERS_REF, last_ref, actual_ref, seen[last_ref]["start"][0][1])
+                contigs[actual_ref] = contigs[seen[last_ref]["start"][0][1]].copy()
+                if seen[last_ref]["start"][0][4] == -1:
+                    contigs[actual_ref].reverse()
                 contigs.pop(seen[last_ref]["start"][0][1], None)
                 contigs.pop(seen[last_ref]["start"][0][7], None)
                 assembly.pop(seen[last_ref]["start"][0][1], None)
@@ -452,7 +1322,7 @@ def find_longest_extension(seen, good, bad, report_list, assembly, last_ref, con
                 del seen[last_ref]["start"][0]
                 del seen[last_ref]["end"][0]
             elif seen[last_ref]["start"][0][7] == seen[last_ref]["end"][0][7]:
-                report_list.append(last_ref + " (" + actual_ref + ")"+ "\t" + seen[last_ref]["start"][0][1] + " and " + seen[last_ref]["start"][0][1] + " both in " + seen[last_ref]["start"][0][7] + "\t" + " Combined query covers ref")
+                report.add(COMBINED_QUERY_COVERS_REF, last_ref, actual_ref, seen[last_ref]["start"][0][1], seen[last_ref]["start"][0][7])
                 start_seq = ''
                 end_seq = ''
                 assembly[actual_ref] = assembly[seen[last_ref]["start"][0][7]]
@@ -470,36 +1340,37 @@ def find_longest_extension(seen, good, bad, report_list, assembly, last_ref, con
                 del seen[last_ref]["end"][0]
                 
             else:
-                if seen[last_ref]["start"][0][1] in good:
+                if good.ref[seen[last_ref]["start"][0][1]] >= 0:
                     if seen[last_ref]["start"][0][1] != actual_ref:
                         bad[seen[last_ref]["start"][0][1]] = 1
-                        good.pop(seen[last_ref]["start"][0][1], None)
+                        absorb_far_end(good, contigs, seen[last_ref]["start"][0], actual_ref)
+                        good.ref[seen[last_ref]["start"][0][1]] = -1
                         assembly.pop(seen[last_ref]["start"][0][1], None)
                         if seen[last_ref]["start"][0][1] != seen[last_ref]["start"][0][7]:
-                            if (seen[last_ref]["start"][0][4] == "1" and seen[last_ref]["start"][0][8] == "-1") or (seen[last_ref]["start"][0][4] == "-1" and seen[last_ref]["start"][0][8] == "1"):
+                            if (seen[last_ref]["start"][0][4] == 1 and seen[last_ref]["start"][0][8] == -1) or (seen[last_ref]["start"][0][4] == -1 and seen[last_ref]["start"][0][8] == 1):
                                 contigs[seen[last_ref]["start"][0][7]].reverse()
-                        elif seen[last_ref]["start"][0][4] == "-1":
+                        elif seen[last_ref]["start"][0][4] == -1:
                             contigs[seen[last_ref]["start"][0][7]].reverse()
                         contigs[seen[last_ref]["start"][0][7]].extend(contigs[actual_ref])
                         contigs[actual_ref] = contigs[seen[last_ref]["start"][0][7]]
-                        if last_ref in good:
-                            good.pop(last_ref, None)
+                        if good.ref[last_ref] >= 0:
+                            good.ref[last_ref] = -1
                         contigs.pop(seen[last_ref]["start"][0][1], None)
                         if seen[last_ref]["start"][0][7] != actual_ref:
                             assembly.pop(seen[last_ref]["start"][0][7], None)
                             contigs.pop(seen[last_ref]["start"][0][7], None)
 
                 else:
-                    good[seen[last_ref]["start"][0][1]] = [actual_ref, "start", seen[last_ref]["start"][0][3], seen[last_ref]["start"][0][4]]
+                    good.set(seen[last_ref]["start"][0][1], actual_ref, START, seen[last_ref]["start"][0][3], seen[last_ref]["start"][0][4])
                     if seen[last_ref]["start"][0][1] != seen[last_ref]["start"][0][7]:
-                        if (seen[last_ref]["start"][0][4] == "1" and seen[last_ref]["start"][0][8] == "-1") or (seen[last_ref]["start"][0][4] == "-1" and seen[last_ref]["start"][0][8] == "1"):
+                        if (seen[last_ref]["start"][0][4] == 1 and seen[last_ref]["start"][0][8] == -1) or (seen[last_ref]["start"][0][4] == -1 and seen[last_ref]["start"][0][8] == 1):
                             contigs[seen[last_ref]["start"][0][7]].reverse()
-                    elif seen[last_ref]["start"][0][4] == "-1":
+                    elif seen[last_ref]["start"][0][4] == -1:
                         contigs[seen[last_ref]["start"][0][7]].reverse()
                     try:
                         contigs[seen[last_ref]["start"][0][7]].extend(contigs[actual_ref])
                     except:
-                        print "last_ref: ", last_ref, "actual_ref:", actual_ref, "\nseen[last_ref]['start'] =", seen[last_ref]["start"], "\ngood[seen[last_ref]['start'][0][1]] =", good[seen[last_ref]["start"][0][1]], "\nbad[seen[last_ref]['start'][0][7]] = ", bad[seen[last_ref]["start"][0][7]]
+                        print "last_ref: ", names[last_ref], "actual_ref:", names[actual_ref], "\nseen[last_ref]['start'] =", seen[last_ref]["start"], "\ngood[seen[last_ref]['start'][0][1]] =", good.entry(seen[last_ref]["start"][0][1]), "\nbad[seen[last_ref]['start'][0][7]] = ", bad[seen[last_ref]["start"][0][7]]
                         raise
                     contigs[actual_ref] = contigs[seen[last_ref]["start"][0][7]]
                     if seen[last_ref]["start"][0][1] != actual_ref:
@@ -508,40 +1379,41 @@ def find_longest_extension(seen, good, bad, report_list, assembly, last_ref, con
                     if seen[last_ref]["start"][0][7] != actual_ref:
                         assembly.pop(seen[last_ref]["start"][0][7], None)
                         contigs.pop(seen[last_ref]["start"][0][7], None)
-                    if last_ref in good:
-                        good.pop(last_ref, None)
+                    if good.ref[last_ref] >= 0:
+                        good.ref[last_ref] = -1
                 
                 
-                if seen[last_ref]["end"][0][1] in good:
+                if good.ref[seen[last_ref]["end"][0][1]] >= 0:
                     if seen[last_ref]["end"][0][1] != actual_ref:
                         bad[seen[last_ref]["end"][0][1]] = 1
-                        good.pop(seen[last_ref]["end"][0][1], None)
+                        absorb_far_end(good, contigs, seen[last_ref]["end"][0], actual_ref)
+                        good.ref[seen[last_ref]["end"][0][1]] = -1
                         assembly.pop(seen[last_ref]["end"][0][1], None)
                         if seen[last_ref]["end"][0][1] != seen[last_ref]["end"][0][7]:
-                            if (seen[last_ref]["end"][0][4] == "1" and seen[last_ref]["end"][0][8] == "-1") or (seen[last_ref]["end"][0][4] == "-1" and seen[last_ref]["end"][0][8] == "1"):
+                            if (seen[last_ref]["end"][0][4] == 1 and seen[last_ref]["end"][0][8] == -1) or (seen[last_ref]["end"][0][4] == -1 and seen[last_ref]["end"][0][8] == 1):
                                 contigs[seen[last_ref]["end"][0][7]].reverse()
-                        elif seen[last_ref]["end"][0][4] == "-1":
+                        elif seen[last_ref]["end"][0][4] == -1:
                             contigs[seen[last_ref]["end"][0][7]].reverse()
                         try:
                             contigs[actual_ref].extend(contigs[seen[last_ref]["end"][0][7]])
                         except:
-                            print "last_ref: ", last_ref, "actual_ref:", actual_ref, "\nseen[last_ref] =", seen[last_ref]["end"]
+                            print "last_ref: ", names[last_ref], "actual_ref:", names[actual_ref], "\nseen[last_ref] =", seen[last_ref]["end"]
                             raise    
                             
-                        if last_ref in good:
-                            good.pop(last_ref, None)
+                        if good.ref[last_ref] >= 0:
+                            good.ref[last_ref] = -1
                         contigs.pop(seen[last_ref]["end"][0][1], None)
                         if seen[last_ref]["end"][0][7] != actual_ref:
                             contigs.pop(seen[last_ref]["end"][0][7], None)
                             assembly.pop(seen[last_ref]["end"][0][7], None)
 
                 else:
-                    good[seen[last_ref]["end"][0][1]] = [actual_ref, "end", seen[last_ref]["end"][0][3], seen[last_ref]["end"][0][4]]
+                    good.set(seen[last_ref]["end"][0][1], actual_ref, END, seen[last_ref]["end"][0][3], seen[last_ref]["end"][0][4])
                     #report_list.append(last_ref + " (" + actual_ref + ")"+ "\t" + seen[last_ref]["end"][0][1] + "\t" + "query added to ref end")
                     if seen[last_ref]["end"][0][1] != seen[last_ref]["end"][0][7]:
-                        if (seen[last_ref]["end"][0][4] == "1" and seen[last_ref]["end"][0][8] == "-1") or (seen[last_ref]["end"][0][4] == "-1" and seen[last_ref]["end"][0][8] == "1"):
+                        if (seen[last_ref]["end"][0][4] == 1 and seen[last_ref]["end"][0][8] == -1) or (seen[last_ref]["end"][0][4] == -1 and seen[last_ref]["end"][0][8] == 1):
                             contigs[seen[last_ref]["end"][0][7]].reverse()
-                    elif seen[last_ref]["end"][0][4] == "-1":
+                    elif seen[last_ref]["end"][0][4] == -1:
                         contigs[seen[last_ref]["end"][0][7]].reverse()
                     contigs[actual_ref].extend(contigs[seen[last_ref]["end"][0][7]])
                     if seen[last_ref]["end"][0][1] != actual_ref:
@@ -550,44 +1422,38 @@ def find_longest_extension(seen, good, bad, report_list, assembly, last_ref, con
                     if seen[last_ref]["end"][0][7] != actual_ref:
                         assembly.pop(seen[last_ref]["end"][0][7], None)
                         contigs.pop(seen[last_ref]["end"][0][7], None)
-                    if last_ref in good:
-                        good.pop(last_ref, None)
+                    if good.ref[last_ref] >= 0:
+                        good.ref[last_ref] = -1
                 del seen[last_ref]["start"][0]
                 del seen[last_ref]["end"][0]
                 
-            '''        
-        seen dictionary:
-        seen[ref_name][end of overlap relative to ref] = [len query extension, query_name, seq of extension, end of overlap relative to query, orientation of query to actual ref, actual ref_name to add extension to, which (ref or query) are combined, actual query_name, ori to actual query]
-        
-        good dictionary:
-        good[best_query_contig] = [ref_contig, end of ref_contig extended, end of query_contig used in extension, orientation of query to final orientation (either just to ref if it's a single contig or to the orientation of merged contigs)]
-            '''
         
         elif pop == 1:
-            if seen[last_ref]["start"][0][1] in good:
+            if good.ref[seen[last_ref]["start"][0][1]] >= 0:
                 if seen[last_ref]["start"][0][1] != actual_ref:
                     bad[seen[last_ref]["start"][0][1]] = 1
-                    good.pop(seen[last_ref]["start"][0][1], None)
+                    absorb_far_end(good, contigs, seen[last_ref]["start"][0], actual_ref)
+                    good.ref[seen[last_ref]["start"][0][1]] = -1
                     assembly.pop(seen[last_ref]["start"][0][1], None)
                     if seen[last_ref]["start"][0][1] != seen[last_ref]["start"][0][7]:
-                        if (seen[last_ref]["start"][0][4] == "1" and seen[last_ref]["start"][0][8] == "-1") or (seen[last_ref]["start"][0][4] == "-1" and seen[last_ref]["start"][0][8] == "1"):
+                        if (seen[last_ref]["start"][0][4] == 1 and seen[last_ref]["start"][0][8] == -1) or (seen[last_ref]["start"][0][4] == -1 and seen[last_ref]["start"][0][8] == 1):
                             contigs[seen[last_ref]["start"][0][7]].reverse()
-                    elif seen[last_ref]["start"][0][4] == "-1":
+                    elif seen[last_ref]["start"][0][4] == -1:
                         contigs[seen[last_ref]["start"][0][7]].reverse()
                     contigs[seen[last_ref]["start"][0][7]].extend(contigs[actual_ref])
                     contigs[actual_ref] = contigs[seen[last_ref]["start"][0][7]]
-                    if last_ref in good:
-                        good.pop(last_ref, None)
+                    if good.ref[last_ref] >= 0:
+                        good.ref[last_ref] = -1
                     contigs.pop(seen[last_ref]["start"][0][1], None)
                     if seen[last_ref]["start"][0][7] != actual_ref:
                         assembly.pop(seen[last_ref]["start"][0][7], None)
                         contigs.pop(seen[last_ref]["start"][0][7], None)
             else:
-                good[seen[last_ref]["start"][0][1]] = [actual_ref, "start", seen[last_ref]["start"][0][3], seen[last_ref]["start"][0][4]]
+                good.set(seen[last_ref]["start"][0][1], actual_ref, START, seen[last_ref]["start"][0][3], seen[last_ref]["start"][0][4])
                 if seen[last_ref]["start"][0][1] != seen[last_ref]["start"][0][7]:
-                    if (seen[last_ref]["start"][0][4] == "1" and seen[last_ref]["start"][0][8] == "-1") or (seen[last_ref]["start"][0][4] == "-1" and seen[last_ref]["start"][0][8] == "1"):
+                    if (seen[last_ref]["start"][0][4] == 1 and seen[last_ref]["start"][0][8] == -1) or (seen[last_ref]["start"][0][4] == -1 and seen[last_ref]["start"][0][8] == 1):
                         contigs[seen[last_ref]["start"][0][7]].reverse()
-                elif seen[last_ref]["start"][0][4] == "-1":
+                elif seen[last_ref]["start"][0][4] == -1:
                     contigs[seen[last_ref]["start"][0][7]].reverse()
                 contigs[seen[last_ref]["start"][0][7]].extend(contigs[actual_ref])
                 contigs[actual_ref] = contigs[seen[last_ref]["start"][0][7]]
@@ -597,35 +1463,36 @@ def find_longest_extension(seen, good, bad, report_list, assembly, last_ref, con
                 if seen[last_ref]["start"][0][7] != actual_ref:
                     assembly.pop(seen[last_ref]["start"][0][7], None)
                     contigs.pop(seen[last_ref]["start"][0][7], None)
-                if last_ref in good:
-                    good.pop(last_ref, None)
+                if good.ref[last_ref] >= 0:
+                    good.ref[last_ref] = -1
             del seen[last_ref]["start"][0]
                         
         elif pop == 2:
-            if seen[last_ref]["end"][0][1] in good:
+            if good.ref[seen[last_ref]["end"][0][1]] >= 0:
                 if seen[last_ref]["end"][0][1] != actual_ref:
                     bad[seen[last_ref]["end"][0][1]] = 1
+                    absorb_far_end(good, contigs, seen[last_ref]["end"][0], actual_ref)
                     if seen[last_ref]["end"][0][1] != seen[last_ref]["end"][0][7]:
-                        if (seen[last_ref]["end"][0][4] == "1" and seen[last_ref]["end"][0][8] == "-1") or (seen[last_ref]["end"][0][4] == "-1" and seen[last_ref]["end"][0][8] == "1"):
+                        if (seen[last_ref]["end"][0][4] == 1 and seen[last_ref]["end"][0][8] == -1) or (seen[last_ref]["end"][0][4] == -1 and seen[last_ref]["end"][0][8] == 1):
                             contigs[seen[last_ref]["end"][0][7]].reverse()
-                    elif seen[last_ref]["end"][0][4] == "-1":
+                    elif seen[last_ref]["end"][0][4] == -1:
                         contigs[seen[last_ref]["end"][0][7]].reverse()
                     contigs[actual_ref].extend(contigs[seen[last_ref]["end"][0][7]])
-                    good.pop(seen[last_ref]["end"][0][1], None)
+                    good.ref[seen[last_ref]["end"][0][1]] = -1
                     assembly.pop(seen[last_ref]["end"][0][1], None)
                     contigs.pop(seen[last_ref]["end"][0][1], None)
                     if seen[last_ref]["end"][0][7] != actual_ref:
                         assembly.pop(seen[last_ref]["end"][0][7], None)
                         contigs.pop(seen[last_ref]["end"][0][7], None)
-                    if last_ref in good:
-                        good.pop(last_ref, None)
+                    if good.ref[last_ref] >= 0:
+                        good.ref[last_ref] = -1
 
             else:
-                good[seen[last_ref]["end"][0][1]] = [actual_ref, "end", seen[last_ref]["end"][0][3], seen[last_ref]["end"][0][4]]
+                good.set(seen[last_ref]["end"][0][1], actual_ref, END, seen[last_ref]["end"][0][3], seen[last_ref]["end"][0][4])
                 if seen[last_ref]["end"][0][1] != seen[last_ref]["end"][0][7]:
-                    if (seen[last_ref]["end"][0][4] == "1" and seen[last_ref]["end"][0][8] == "-1") or (seen[last_ref]["end"][0][4] == "-1" and seen[last_ref]["end"][0][8] == "1"):
+                    if (seen[last_ref]["end"][0][4] == 1 and seen[last_ref]["end"][0][8] == -1) or (seen[last_ref]["end"][0][4] == -1 and seen[last_ref]["end"][0][8] == 1):
                         contigs[seen[last_ref]["end"][0][7]].reverse()
-                elif seen[last_ref]["end"][0][4] == "-1":
+                elif seen[last_ref]["end"][0][4] == -1:
                     contigs[seen[last_ref]["end"][0][7]].reverse()
                 contigs[actual_ref].extend(contigs[seen[last_ref]["end"][0][7]])
                 if seen[last_ref]["end"][0][1] != actual_ref:
@@ -634,239 +1501,1430 @@ def find_longest_extension(seen, good, bad, report_list, assembly, last_ref, con
                 if seen[last_ref]["end"][0][7] != actual_ref:
                     assembly.pop(seen[last_ref]["end"][0][7], None)
                     contigs.pop(seen[last_ref]["end"][0][7], None)
-                if last_ref in good:
-                    good.pop(last_ref, None)
+                if good.ref[last_ref] >= 0:
+                    good.ref[last_ref] = -1
             del seen[last_ref]["end"][0]
         
         try:
-            new_seq = start_seq + assembly[actual_ref] + end_seq
+            new_seq = Scaffold.join([start_seq, assembly[actual_ref], end_seq])
         except:
-            print "actual_ref not in assebly dict! actual_ref =", actual_ref, "last_ref =", last_ref, "/nbad[actual_ref] =", bad[actual_ref], "\ngood[actual_ref] =", good[actual_ref]
+            print "actual_ref not in assebly dict! actual_ref =", names[actual_ref], "last_ref =", names[last_ref], "/nbad[actual_ref] =", bad[actual_ref], "\ngood[actual_ref] =", good.entry(actual_ref)
             raise
         
         if final_name != actual_ref:
             bad[actual_ref] = 1
             contigs[final_name] = contigs[actual_ref]
-            report_list.append(actual_ref + "\t" + final_name + "\t" + "actual_ref is not equal to final_ref")
-            if contigs[final_name][0] in good:
-                good[contigs[final_name][0]][0] = final_name
-            if contigs[final_name][-1] in good:
-                good[contigs[final_name][-1]][0] = final_name
+            report.add(RENAMED, actual_ref, final_name)
             contigs.pop(actual_ref, None)
             assembly.pop(actual_ref, None)
-        if final_name_dict[final_name] == "1":
+        for end_contig in set((contigs[final_name].first, contigs[final_name].last)):
+            if good.ref[end_contig] == actual_ref:
+                good.move(end_contig, final_name, final_name_dict[final_name])
+            elif good.ref[end_contig] >= 0 and final_name != actual_ref:
+                good.ref[end_contig] = final_name
+        if final_name_dict[final_name] == 1:
             assembly[final_name] = new_seq
         else:
-            assembly[final_name] = fastaIO.reverse_complement(new_seq)
+            assembly[final_name] = new_seq.reverse_complement()
             contigs[final_name].reverse()
         processed[last_ref] = 1    
             
-        for item in seen[last_ref]["start"]:
-            if item[1] not in bad:
-                if item[1] not in good:
-                    both = 0
+        start_short = seen[last_ref]["start"] + remaining_extensions(start_heap)
+        end_short = seen[last_ref]["end"] + remaining_extensions(end_heap)
+        end_counts = {}
+        for item in end_short:
+            end_counts[item[1]] = end_counts.get(item[1], 0) + 1
+        for item in start_short:
+            if not bad[item[1]]:
+                if good.ref[item[1]] < 0:
+                    both = end_counts.get(item[1], 0)
                     bad[item[1]] = 1
                     assembly.pop(item[1], None)
                     contigs.pop(item[1], None)
-                    for item2 in seen[last_ref]["end"]:
-                        if item2[1] == item[1]:
-                            report_list.append(last_ref + "\t" + item[1] + "\t" + "both_ends_short")
-                            both = 1
+                    for i in xrange(both):
+                        report.add(BOTH_ENDS_SHORT, last_ref, -1, item[1])
                     if both == 0:
-                        report_list.append(last_ref + "\t" + item[1] + "\t" + "start_short")
+                        report.add(START_SHORT, last_ref, -1, item[1])
                 else:
-                    report_list.append(last_ref + "\t" + item[1] + "\t" + "start_short but contig is in good")
+                    report.add(START_SHORT_IN_GOOD, last_ref, -1, item[1])
         
-        for item in seen[last_ref]["end"]:
-            if item[1] not in bad:
-                if item[1] not in good:
+        for item in end_short:
+            if not bad[item[1]]:
+                if good.ref[item[1]] < 0:
                     bad[item[1]] = 1
                     assembly.pop(item[1], None)
                     contigs.pop(item[1], None)
-                    report_list.append(last_ref + "\t" + item[1] + "\t" + "end_short")
+                    report.add(END_SHORT, last_ref, -1, item[1])
                 else:
-                    report_list.append(last_ref + "\t" + item[1] + "\t" + "end_short but contig is in good")
+                    report.add(END_SHORT_IN_GOOD, last_ref, -1, item[1])
                     
         for seq_name in final_name_list:
-            if seq_name != final_name and seq_name not in good:
+            if seq_name != final_name and good.ref[seq_name] < 0:
                 bad[seq_name] = 1
                 assembly.pop(seq_name, None)
-                good.pop(seq_name, None)
+                good.ref[seq_name] = -1
                 contigs.pop(seq_name, None)
         
     seen = Vividict()
-    last_ref = ''
+    last_ref = -1
     return seen, assembly, good, bad, last_ref, contigs, covers, processed
 
-def clear_multiple_matches(previous_ref, seen, bad, processed):
-    last_ref = previous_ref
-    if len(seen[last_ref]["start"]) > 0:
-        if len(seen[last_ref]["end"]) > 0:
-            if seen[last_ref]["start"][-1][1] == seen[last_ref]["end"][-1][1]:
-                bad[last_ref] = 1
-                processed[last_ref] = 1
-                bad[seen[last_ref]["start"][-1][1]] = 1
-                seen[last_ref]["start"].pop(-1)
-                seen[last_ref]["end"].pop(-1)
-            elif len(seen[last_ref]["start"]) > 1 and seen[last_ref]["start"][-1][1] == seen[last_ref]["start"][-2][1]:
-                if seen[last_ref]["start"][-1][6] > seen[last_ref]["start"][-2][6]:
-                    seen[last_ref]["start"].pop(-2)
-                elif seen[last_ref]["start"][-1][6] == seen[last_ref]["start"][-2][6]:
-                    if seen[last_ref]["start"][-1][0] >= seen[last_ref]["start"][-2][0]:
-                        seen[last_ref]["start"].pop(-2)
-                    else:
-                        seen[last_ref]["start"].pop(-1)
-                else:
-                    seen[last_ref]["start"].pop(-1)
-            elif len(seen[last_ref]["end"]) > 1 and seen[last_ref]["end"][-1][1] == seen[last_ref]["end"][-2][1]:
-                if seen[last_ref]["end"][-1][6] > seen[last_ref]["end"][-2][6]:
-                    seen[last_ref]["end"].pop(-2)
-                elif seen[last_ref]["end"][-1][6] == seen[last_ref]["end"][-2][6]:
-                    if seen[last_ref]["end"][-1][0] >= seen[last_ref]["end"][-2][0]:
-                        seen[last_ref]["end"].pop(-2)
-                    else:
-                        seen[last_ref]["end"].pop(-1)
-                else:
-                    seen[last_ref]["end"].pop(-1)
-        elif len(seen[last_ref]["start"]) > 1 and seen[last_ref]["start"][-1][1] == seen[last_ref]["start"][-2][1]:
-            if seen[last_ref]["start"][-1][6] > seen[last_ref]["start"][-2][6]:
-                seen[last_ref]["start"].pop(-2)
-            elif seen[last_ref]["start"][-1][6] == seen[last_ref]["start"][-2][6]:
-                if seen[last_ref]["start"][-1][0] >= seen[last_ref]["start"][-2][0]:
-                    seen[last_ref]["start"].pop(-2)
+def clear_multiple_matches(ref, query, seen, bad, processed):
+    '''Called for consecutive lines of the same reference and query. If the query has a hit at both ends of the reference, both hits are dropped, the query is put in bad and the reference in bad and processed.
+    Repeated hits of a query at the same end are already resolved by add_extension.'''
+    if query in seen[ref]["start"] and query in seen[ref]["end"]:
+        bad[ref] = 1
+        processed[ref] = 1
+        bad[query] = 1
+        del seen[ref]["start"][query]
+        del seen[ref]["end"][query]
+    return seen, bad, processed
+    
+Overlap = namedtuple("Overlap", ["ref_start", "ref_end", "query_start", "query_end", "ref_align_len", "query_align_len", "percent_id", "ref_len", "query_len", "ref_coverage", "query_coverage", "frame", "strand", "ref_name", "query_name", "tag"])
+
+def parse_overlap(line):
+    '''Converts one nucmer tab line into an Overlap with int coordinates and strands, float identity and coverage, contig ids from contig_names and an interned tag.'''
+    ref_start, ref_end, query_start, query_end, ref_align_len, query_align_len, percent_id, ref_len, query_len, ref_coverage, query_coverage, frame, strand, ref_name, query_name, tag = line.split("\t")
+    return Overlap(int(ref_start), int(ref_end), int(query_start), int(query_end), int(ref_align_len), int(query_align_len), float(percent_id), int(ref_len), int(query_len), float(ref_coverage), float(query_coverage), int(frame), int(strand), contig_names.id(ref_name), contig_names.id(query_name), intern(tag))
+
+def read_overlap_records(handle, index=0, header=True, position=None):
+    '''Yields (record index, run index, None, Overlap) for every tagged line of a nucmer tab file. A run is a stretch of consecutive records with the same ref_name.
+    To start from a checkpoint offset, index is the index of the first record and header is False. If position is given, position[0] is kept at the byte offset of the line of the last record yielded.'''
+    run = -1
+    run_ref = None
+    offset = handle.tell() if position is not None else 0
+    c = 0 if header else 1
+    tagged = thresholds.tagged
+    dropped = merge_stats.dropped if merge_stats is not None else None
+    for line in handle:
+        line_offset = offset
+        offset += len(line)
+        line = line.strip()
+        if c == 0:
+            c += 1
+            continue
+        if not tagged(line):
+            if dropped is not None:
+                dropped["untagged"] += 1
+            continue
+        overlap = parse_overlap(line)
+        if overlap.ref_name != run_ref:
+            run += 1
+            run_ref = overlap.ref_name
+        if position is not None:
+            position[0] = line_offset
+        yield index, run, None, overlap
+        index += 1
+
+def skip_records(records, index):
+    '''Drops the records before index. Used to resume from a checkpoint when the overlap input can not be seeked into.'''
+    for record in records:
+        if record[0] >= index:
+            yield record
+
+def drop_contained_records(records, removed):
+    '''Drops the records with a reference or query removed by the containment prefilter. merge_overlaps would skip them anyway once the contig is in bad.'''
+    dropped = merge_stats.dropped if merge_stats is not None else None
+    for record in records:
+        overlap = record[3]
+        if removed[overlap.ref_name] or removed[overlap.query_name]:
+            if dropped is not None:
+                dropped["contained"] += 1
+            continue
+        yield record
+
+def containment_sketch(seq, k, scale):
+    '''Returns the FracMinHash sketch of seq, which must be upper case: the set of hashes of its canonical k-mers that are multiples of scale. The share of a contig\'s sketch found in another contig\'s sketch estimates how much of it the other contains, on either strand.'''
+    reverse = reverse_complement(seq)
+    length = len(seq)
+    sketch = set()
+    for i in xrange(length - k + 1):
+        kmer = seq[i:i + k]
+        reverse_kmer = reverse[length - i - k:length - i]
+        value = hash(kmer if kmer < reverse_kmer else reverse_kmer)
+        if value % scale == 0:
+            sketch.add(value)
+    return sketch
+
+def contained_in(seq, container, k, tolerance=0.02):
+    '''Checks a sketch hit: returns 100 if seq is found whole in container on either strand, 98 if its first and last k-mers are found on one strand within tolerance of the right distance apart, and 0 otherwise.'''
+    for strand_seq in (seq, reverse_complement(seq)):
+        if strand_seq in container:
+            return 100
+    for strand_seq in (seq, reverse_complement(seq)):
+        first = container.find(strand_seq[:k])
+        last = container.find(strand_seq[-k:], max(first, 0))
+        if first >= 0 and last >= 0 and abs(last - first - (len(seq) - k)) <= tolerance * len(seq):
+            return 98
+    return 0
+
+def contained_contigs(assembly, k=21, min_containment=0.95, scale=1000, min_hashes=2):
+    '''Finds the contigs of assembly almost certainly contained in a longer one (or an identical one with a lower id).
+    Contigs are taken longest first and their sketches checked against the sketches of the contigs kept so far, so a container is never itself removed. The best sketch hit is then confirmed on the sequences with contained_in.
+    index maps each sampled hash to the kept contig holding it, or to an array of ids for the few hashes (mostly in overlaps) held by more than one.
+    Returns [(contig, container, 100 or 98 from contained_in), ...] in that order.'''
+    index = {}
+    contained = []
+    for contig in sorted(assembly, key=lambda contig: (-len(assembly[contig]), contig)):
+        seq = assembly[contig][:].upper()
+        sketch = containment_sketch(seq, k, scale)
+        if len(sketch) >= min_hashes:
+            shared = {}
+            for value in sketch:
+                other = index.get(value)
+                if other is None:
+                    continue
+                if isinstance(other, array):
+                    for other in other:
+                        shared[other] = shared.get(other, 0) + 1
                 else:
-                    seen[last_ref]["start"].pop(-1)
+                    shared[other] = shared.get(other, 0) + 1
+            if shared:
+                container = min(shared, key=lambda other: (-shared[other], other))
+                if shared[container] >= min_containment * len(sketch):
+                    coverage = contained_in(seq, assembly[container][:].upper(), k)
+                    if coverage:
+                        contained.append((contig, container, coverage))
+                        continue
+        for value in sketch:
+            other = index.get(value)
+            if other is None:
+                index[value] = contig
+            elif isinstance(other, array):
+                other.append(contig)
             else:
-                seen[last_ref]["start"].pop(-1)
-    elif len(seen[last_ref]["end"]) > 1:
-        if seen[last_ref]["end"][-1][1] == seen[last_ref]["end"][-2][1]:
-            if seen[last_ref]["end"][-1][6] > seen[last_ref]["end"][-2][6]:
-                seen[last_ref]["end"].pop(-2)
-            elif seen[last_ref]["end"][-1][6] == seen[last_ref]["end"][-2][6]:
-                if seen[last_ref]["end"][-1][0] >= seen[last_ref]["end"][-2][0]:
-                    seen[last_ref]["end"].pop(-2)
-                else:
-                    seen[last_ref]["end"].pop(-1)
+                index[value] = array("l", (other, contig))
+    return contained
+
+overlap_int_columns = (0, 1, 2, 3, 4, 5, 7, 8, 11, 12)
+overlap_float_columns = (6, 9, 10)
+overlap_name_columns = (13, 14)
+
+def tagged_line_mask(buf, ends, tag_list):
+    '''Returns a bool array with one slot per line of a chunk, True for the lines holding one of tag_list (all lines if it is empty).
+    buf is the chunk as a uint8 array and ends the position of each line\'s newline. Tags never hold a newline, so each match is inside one line.'''
+    mask = numpy.zeros(len(ends), dtype=bool)
+    if not tag_list:
+        mask[:] = True
+        return mask
+    for tag in tag_list:
+        pattern = numpy.frombuffer(tag, dtype=numpy.uint8)
+        found = numpy.flatnonzero(buf[:len(buf) - len(pattern) + 1] == pattern[0])
+        for j in xrange(1, len(pattern)):
+            found = found[buf[found + j] == pattern[j]]
+        mask[numpy.searchsorted(ends, found)] = True
+    return mask
+
+def numeric_column(values, dtype):
+    '''Converts a list of number strings to a list of Python numbers in one numpy call. A bad value is converted again with int or float, which raises the usual ValueError.'''
+    column = numpy.fromstring(" ".join(values), dtype=dtype, sep=" ")
+    if len(column) != len(values):
+        return map(int if dtype == numpy.int64 else float, values)
+    return column.tolist()
+
+def read_overlap_records_numpy(handle, chunk_lines=1 << 18):
+    '''Yields the same records as read_overlap_records, minus self hits and lines with identity at or below thresholds.min_identity, which merge_overlaps skips before they can change any state.
+    Lines are read chunk_lines at a time. The tag test and the field count check run on the chunk\'s bytes, the filter on whole columns, and only the lines kept are converted, each column in one numpy call. Run indexes are worked out before lines are dropped so reference groups stay the same.'''
+    handle = iter(handle)
+    next(handle, None)
+    tag_list = thresholds.tag_list
+    index = 0
+    run = -1
+    run_ref = None
+    line_number = 1
+    while True:
+        chunk = list(islice(handle, chunk_lines))
+        if not chunk:
+            break
+        first_line = line_number + 1
+        line_number += len(chunk)
+        text = "".join(chunk)
+        buf = numpy.frombuffer(text, dtype=numpy.uint8)
+        ends = numpy.flatnonzero(buf == 10)
+        if len(ends) < len(chunk):
+            ends = numpy.append(ends, len(buf))
+        tagged = tagged_line_mask(buf, ends, tag_list)
+        tabs = numpy.diff(numpy.concatenate(([0], numpy.searchsorted(numpy.flatnonzero(buf == 9), ends))))
+        bad = numpy.flatnonzero(tagged & (tabs != 15))
+        if len(bad):
+            i = int(bad[0])
+            raise ValueError("Overlap line %d has %d tab separated fields, not 16: %r" % (first_line + i, tabs[i] + 1, chunk[i].strip()))
+        tagged_at = numpy.flatnonzero(tagged)
+        n = len(tagged_at)
+        if merge_stats is not None:
+            merge_stats.dropped["untagged"] += len(ends) - n
+        if n == 0:
+            continue
+        lines = chunk
+        if n < len(chunk):
+            lines = [chunk[i] for i in tagged_at.tolist()]
+            text = "".join(lines)
+        fields = text.replace("\r", "").replace("\n", "\t").split("\t")
+        
+        refs = numpy.array(fields[13::16][:n])
+        new_run = numpy.empty(n, dtype=bool)
+        new_run[0] = fields[13] != run_ref
+        new_run[1:] = refs[1:] != refs[:-1]
+        runs = (run + numpy.cumsum(new_run)).tolist()
+        run = runs[-1]
+        run_ref = fields[16 * (n - 1) + 13]
+        self_hits = refs == numpy.array(fields[14::16][:n])
+        low_identity = numpy.array(fields[6::16][:n], dtype=float) <= thresholds.min_identity
+        keep = numpy.flatnonzero(~(low_identity | self_hits))
+        if merge_stats is not None:
+            merge_stats.dropped["self_hit"] += int(self_hits.sum())
+            merge_stats.dropped["low_identity"] += int((low_identity & ~self_hits).sum())
+        if len(keep) == 0:
+            index += n
+            continue
+        
+        keep = keep.tolist()
+        if len(keep) < n:
+            fields = "".join([lines[i] for i in keep]).replace("\r", "").replace("\n", "\t").split("\t")
+        columns = []
+        for c in xrange(16):
+            values = fields[c::16][:len(keep)]
+            if c in overlap_int_columns:
+                columns.append(numeric_column(values, numpy.int64))
+            elif c in overlap_float_columns:
+                columns.append(numeric_column(values, float))
+            elif c in overlap_name_columns:
+                columns.append(map(contig_names.id, values))
             else:
-                seen[last_ref]["end"].pop(-1)
-    return seen, bad, processed
+                columns.append([intern(value.strip()) for value in values])
+        for i, values in izip(keep, izip(*columns)):
+            yield index + i, runs[i], None, Overlap._make(values)
+        index += n
+
+def grouped_overlap_lines(overlap_file, threads=2):
+    '''Yields the lines of an overlap file with all lines of each ref_name brought together, refs in name order (which is contig id order) and lines within a ref in file order, so the merge does not depend on the order the refs come in.
+    A compressed file can not be seeked into, so its tagged lines are first written out to a temporary file and grouped from there. The untagged lines left out are counted in --stats.'''
+    if is_compressed(overlap_file):
+        tagged = thresholds.tagged
+        with open_input(overlap_file, threads) as f:
+            spill = tempfile.TemporaryFile()
+            try:
+                spill.write(f.readline())
+                untagged = 0
+                for line in f:
+                    if tagged(line):
+                        spill.write(line)
+                    else:
+                        untagged += 1
+                if merge_stats is not None:
+                    merge_stats.dropped["untagged"] += untagged
+                spill.seek(0)
+                for line in grouped_lines(spill):
+                    yield line
+            finally:
+                spill.close()
+        return
+    with open(overlap_file, "rb") as f:
+        for line in grouped_lines(f):
+            yield line
+
+def grouped_lines(f):
+    '''Does the grouping for grouped_overlap_lines on the open file f. The first pass only keeps the offset and line count of each stretch of lines for a ref, the second pass seeks back to read them.
+    Untagged lines inside a stretch are passed on for the reader to drop and count, the ones before the first tagged line are counted here.'''
+    runs = {}
+    tagged = thresholds.tagged
+    header = f.readline()
+    offset = len(header)
+    current = None
+    for line in f:
+        if not tagged(line):
+            if current is not None:
+                current[1] += 1
+            elif merge_stats is not None:
+                merge_stats.dropped["untagged"] += 1
+        else:
+            ref_name = line.split("\t", 14)[13]
+            if current is not None and ref_name == current_ref:
+                current[1] += 1
+            else:
+                current = [offset, 1]
+                current_ref = ref_name
+                if ref_name not in runs:
+                    runs[ref_name] = []
+                runs[ref_name].append(current)
+        offset += len(line)
     
-def main():
+    yield header
+    for ref_name in sorted(runs):
+        for offset, count in runs[ref_name]:
+            f.seek(offset)
+            for i in xrange(count):
+                yield f.readline()
 
-    bad = {}
-    good = {}
-    processed = {}
-    covers = {}
-    report_list = []
-    assembly = OrderedDict()
-    contigs = OrderedDict()
-    last = []
-    seen = Vividict()
-    bad_out = os.path.splitext(sys.argv[1])[0] + "_" + sys.argv[3] + "_report.out"
-    contigs_out = os.path.splitext(sys.argv[1])[0] + "_" + sys.argv[3] + "_contigs.out"
-    
-    with open(sys.argv[2], "r") as f:
-        for title, seq in fastaIO.FastaGeneralIterator(f):
-            assembly[title] = seq
-            contigs[title] = [title]
-    
-    with open(sys.argv[1], "r") as f:
-        c = 0
-        last_ref = ''
-        last_query = ''
+def overlap_contig_names(overlap_file, threads=2):
+    '''First pass of --pass-through. Returns the set of contig names on the tagged lines of overlap_file that merge_overlaps does not skip outright, that is all but self hits and lines at or below thresholds.min_identity.'''
+    names = set()
+    tagged = thresholds.tagged
+    min_identity = thresholds.min_identity
+    with open_input(overlap_file, threads) as f:
+        f.readline()
         for line in f:
-            line = line.strip()
-            if c == 0:
-                c += 1
+            if not tagged(line):
                 continue
-            if "CONTAINS" not in line and "IDENTITY" not in line and "END" not in line and "BEGIN" not in line and "CONTAINED" not in line:
+            fields = line.split("\t", 15)
+            if fields[13] == fields[14] or float(fields[6]) <= min_identity:
                 continue
-            
-            ref_start, ref_end, query_start, query_end, ref_align_len, query_align_len, percent_id, ref_len, query_len, ref_coverage, query_coverage, frame, strand, ref_name, query_name, tag = line.split("\t")
-                        
-            if last_ref and ref_name != last_ref:
-                seen, assembly, good, bad, last_ref, contigs, covers, processed = find_longest_extension(seen, good, bad, report_list, assembly, last_ref, contigs, covers, processed)
-            
-            if ref_name == query_name:
-                continue
-            if ref_name in bad:
-                continue
-            if query_name in bad or query_name in covers or query_name in processed:
-                continue
-            if float(percent_id) <= 94.99:
-                continue
-            previous_ref = last_ref
-            last_ref = ref_name
-                        
-            if ref_name not in good:
-                if query_name not in good:
-                    if query_name < ref_name:
-                        continue
-                    bad, seen, assembly, good, contigs = process_single(seen, good, assembly, bad, report_list, contigs, ref_start, ref_end, query_start, query_end, ref_align_len, query_align_len, percent_id, ref_len, query_len, ref_coverage, query_coverage, frame, strand, ref_name, query_name, tag)
-                    if last_query == query_name and previous_ref == ref_name:
-                        if len(seen[ref_name]["start"]) > 0 or len(seen[ref_name]["end"])> 0:
-                            seen, bad, processed = clear_multiple_matches(previous_ref, seen, bad, processed)
-                    last_query = query_name
-                else:
-                    if good[query_name][0] in bad:
-                        continue
-                    bad, seen, assembly, good = process_query_combined(seen, good, assembly, bad, report_list, contigs, ref_start, ref_end, query_start, query_end, ref_align_len, query_align_len, percent_id, ref_len, query_len, ref_coverage, query_coverage, frame, strand, ref_name, query_name, tag)
-                    if last_query == query_name and previous_ref == ref_name:
-                        if len(seen[ref_name]["start"]) > 0 or len(seen[ref_name]["end"])> 0:
-                            seen, bad, processed = clear_multiple_matches(previous_ref, seen, bad, processed)
-                    last_query = query_name
-                            
-            else: #ref_name in good:
-                if good[ref_name][0] in bad or good[ref_name][0] == query_name:
-                    continue
-                if query_name in good:
-                    if good[query_name][0] in bad:
-                         continue
-                    bad, seen, assembly, good = process_both_combined(seen, good, assembly, bad, report_list, contigs, ref_start, ref_end, query_start, query_end, ref_align_len, query_align_len, percent_id, ref_len, query_len, ref_coverage, query_coverage, frame, strand, ref_name, query_name, tag)
-                    if last_query == query_name and previous_ref == ref_name:
-                        if len(seen[ref_name]["start"]) > 0 or len(seen[ref_name]["end"])> 0:
-                            seen, bad, processed = clear_multiple_matches(previous_ref, seen, bad, processed)
-                    last_query = query_name
-                else:
-                    if query_name in bad:
-                        continue
-                    else:
-                        bad, seen, assembly, good = process_ref_combined(seen, good, assembly, bad, report_list, contigs, ref_start, ref_end, query_start, query_end, ref_align_len, query_align_len, percent_id, ref_len, query_len, ref_coverage, query_coverage, frame, strand, ref_name, query_name, tag)
-                        if last_query == query_name and previous_ref == ref_name:
-                            if len(seen[ref_name]["start"]) > 0 or len(seen[ref_name]["end"])> 0:
-                                seen, bad, processed = clear_multiple_matches(previous_ref, seen, bad, processed)
-                        last_query = query_name
+            names.add(fields[13])
+            names.add(fields[14])
+    return names
+
+merge_stats = None
+
+instrumented_functions = ("process_overlap", "find_longest_extension", "clear_multiple_matches")
+
+def peak_rss():
+    '''Peak resident set size of this process so far, in kilobytes.'''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss //= 1024
+    return rss
+
+class MergeStats(object):
+    '''Counters and timers for --stats, filled in by merge_overlaps while merge_stats is set. See enable_stats.
+    Table sizes are sampled every sample_every reference groups and the slowest reference groups are kept in a heap.
+    process_overlap also counts its calls and time per overlap kind (named after the process_* functions it replaced), and how often each case in overlap_cases took an extension.'''
+    def __init__(self, sample_every=1000, slowest=20):
+        self.sample_every = sample_every
+        self.slowest = slowest
+        self.start = time.time()
+        self.samples = []
+        self.reset()
+    
+    def restart(self):
+        '''Clears everything, for the next round of --rounds.'''
+        self.start = time.time()
+        self.samples = []
+        self.reset()
+    
+    def reset(self):
+        self.calls = dict.fromkeys(instrumented_functions, 0)
+        self.seconds = dict.fromkeys(instrumented_functions, 0.0)
+        self.kind_calls = [0] * len(overlap_kind_names)
+        self.kind_seconds = [0.0] * len(overlap_kind_names)
+        self.cases = {}
+        self.dropped = OrderedDict.fromkeys(("untagged", "self_hit", "ref_in_bad", "query_done", "low_identity", "query_before_ref", "combined_ref_in_bad", "contained"), 0)
+        self.groups = 0
+        self.rows = 0
+        self.largest_seen = 0
+        self.slowest_groups = []
+    
+    def timed(self, name, function):
+        '''Returns function wrapped to count its calls and wall time under name.'''
+        def timed_function(*args):
+            start = time.time()
+            try:
+                return function(*args)
+            finally:
+                self.seconds[name] += time.time() - start
+                self.calls[name] += 1
+        timed_function.__name__ = function.__name__
+        return timed_function
+    
+    def candidates(self, seen):
+        '''Returns the number of extensions waiting in seen.'''
+        count = 0
+        for ends in seen.itervalues():
+            for extensions in ends.itervalues():
+                count += len(extensions)
+        return count
+    
+    def end_group(self, ref, rows, candidates, start, good, bad, covers, processed):
+        '''Records a finished reference group: its rows, the extensions it collected and the time from its first row to the end of find_longest_extension.'''
+        group = (time.time() - start, ref, rows, candidates)
+        self.groups += 1
+        self.rows += rows
+        self.largest_seen = max(self.largest_seen, candidates)
+        if len(self.slowest_groups) < self.slowest:
+            heapq.heappush(self.slowest_groups, group)
+        elif group > self.slowest_groups[0]:
+            heapq.heapreplace(self.slowest_groups, group)
+        if self.groups % self.sample_every == 0:
+            self.sample(good, bad, covers, processed)
+    
+    def sample(self, good, bad, covers, processed):
+        '''Appends the current sizes of the merge tables.'''
+        self.samples.append(OrderedDict([
+            ("seconds", round(time.time() - self.start, 3)),
+            ("groups", self.groups),
+            ("rows", self.rows),
+            ("good", len(good.ref) - good.ref.count(-1)),
+            ("bad", len(bad) - bad.count("\0")),
+            ("covers", len(covers) - covers.count(-1)),
+            ("processed", len(processed) - processed.count("\0")),
+            ("peak_rss_kb", peak_rss()),
+        ]))
+    
+    def take(self):
+        '''Returns the counters gathered since the last take and resets them. merge_component sends these back from the worker processes.'''
+        counts = (self.calls, self.seconds, self.kind_calls, self.kind_seconds, self.cases, self.dropped, self.groups, self.rows, self.largest_seen, self.slowest_groups)
+        self.reset()
+        return counts
+    
+    def add(self, counts):
+        '''Adds counters returned by take in a worker process.'''
+        calls, seconds, kind_calls, kind_seconds, cases, dropped, groups, rows, largest_seen, slowest_groups = counts
+        for name in instrumented_functions:
+            self.calls[name] += calls[name]
+            self.seconds[name] += seconds[name]
+        for kind in xrange(len(overlap_kind_names)):
+            self.kind_calls[kind] += kind_calls[kind]
+            self.kind_seconds[kind] += kind_seconds[kind]
+        for label in cases:
+            self.cases[label] = self.cases.get(label, 0) + cases[label]
+        for name in dropped:
+            self.dropped[name] += dropped[name]
+        self.groups += groups
+        self.rows += rows
+        self.largest_seen = max(self.largest_seen, largest_seen)
+        for group in slowest_groups:
+            if len(self.slowest_groups) < self.slowest:
+                heapq.heappush(self.slowest_groups, group)
+            elif group > self.slowest_groups[0]:
+                heapq.heapreplace(self.slowest_groups, group)
+    
+    def summary(self):
+        '''Returns the counters as an OrderedDict ready for json.dump.'''
+        names = contig_names.names
+        functions = OrderedDict()
+        for name in instrumented_functions:
+            functions[name] = OrderedDict([("calls", self.calls[name]), ("seconds", round(self.seconds[name], 4))])
+        overlap_kinds = OrderedDict()
+        for kind, name in enumerate(overlap_kind_names):
+            overlap_kinds[name] = OrderedDict([("calls", self.kind_calls[kind]), ("seconds", round(self.kind_seconds[kind], 4))])
+        overlap_case_counts = OrderedDict(sorted(self.cases.iteritems(), key=lambda item: (-item[1], item[0])))
+        slowest_groups = []
+        for seconds, ref, rows, candidates in sorted(self.slowest_groups, reverse=True):
+            slowest_groups.append(OrderedDict([("ref", names[ref]), ("seconds", round(seconds, 4)), ("rows", rows), ("candidates", candidates)]))
+        return OrderedDict([
+            ("seconds", round(time.time() - self.start, 3)),
+            ("groups", self.groups),
+            ("rows", self.rows),
+            ("functions", functions),
+            ("overlap_kinds", overlap_kinds),
+            ("overlap_cases", overlap_case_counts),
+            ("dropped", self.dropped),
+            ("largest_seen", self.largest_seen),
+            ("slowest_groups", slowest_groups),
+            ("samples", self.samples),
+            ("peak_rss_kb", peak_rss()),
+        ])
+
+def enable_stats(sample_every=1000):
+    '''Installs a MergeStats as merge_stats and replaces the functions named in instrumented_functions with timed versions.'''
+    global merge_stats
+    merge_stats = MergeStats(sample_every)
+    module = globals()
+    for name in instrumented_functions:
+        module[name] = merge_stats.timed(name, module[name])
+    return merge_stats
+
+def merge_overlaps(records, assembly, contigs, good, bad, covers, processed, report, stamped=False, checkpoint=None):
+    '''Runs the merge over records from read_overlap_records. The reference group collected in seen is resolved by find_longest_extension whenever the run changes.
+    With stamped set, report and assembly are the Stamped* containers of a worker process and every change is tagged with its position in the serial run.
+    With a Checkpoint, the state is saved between reference groups whenever it is due.'''
+    seen = Vividict()
+    last_ref = -1
+    last_query = -1
+    last_run = None
+    flush_index = None
+    stats = merge_stats
+    dropped = stats.dropped if stats is not None else {}
+    group_ref = -1
+    group_rows = 0
+    group_start = 0
+    min_identity = thresholds.min_identity
+    for index, run, next_run_index, overlap in records:
+        percent_id = overlap.percent_id
+        ref_name = overlap.ref_name
+        query_name = overlap.query_name
+        
+        if run != last_run:
+            if stats is not None and group_rows:
+                candidates = stats.candidates(seen)
+            if last_ref >= 0:
+                if stamped:
+                    report.stamp = assembly.stamp = (flush_index, 0)
+                seen, assembly, good, bad, last_ref, contigs, covers, processed = find_longest_extension(seen, good, bad, report, assembly, last_ref, contigs, covers, processed)
+            if stats is not None:
+                if group_rows:
+                    stats.end_group(group_ref, group_rows, candidates, group_start, good, bad, covers, processed)
+                group_ref = ref_name
+                group_rows = 0
+                group_start = time.time()
+            if checkpoint is not None and checkpoint.due():
+                checkpoint.save(index, assembly, contigs, good, bad, covers, processed, report)
+            last_query = -1
+            last_run = run
+            flush_index = next_run_index
+        if stats is not None:
+            group_rows += 1
         
-        seen, assembly, good, bad, last_ref, contigs, covers, processed = find_longest_extension(seen, good, bad, report_list, assembly, last_ref, contigs, covers, processed)        
-    for item in good:
+        if ref_name == query_name:
+            if stats is not None:
+                dropped["self_hit"] += 1
+            continue
+        if bad[ref_name]:
+            if stats is not None:
+                dropped["ref_in_bad"] += 1
+            continue
+        if bad[query_name] or covers[query_name] >= 0 or processed[query_name]:
+            if stats is not None:
+                dropped["query_done"] += 1
+            continue
+        if percent_id <= min_identity:
+            if stats is not None:
+                dropped["low_identity"] += 1
+            continue
+        if stamped:
+            report.stamp = assembly.stamp = (index, 1)
+        previous_ref = last_ref
+        last_ref = ref_name
+                    
+        combined_ref_name = good.ref[ref_name]
+        combined_query_name = good.ref[query_name]
+        if combined_ref_name < 0 and combined_query_name < 0 and query_name < ref_name:
+            if stats is not None:
+                dropped["query_before_ref"] += 1
+            continue
+        if (combined_ref_name >= 0 and (bad[combined_ref_name] or combined_ref_name == query_name)) or (combined_query_name >= 0 and bad[combined_query_name]):
+            if stats is not None:
+                dropped["combined_ref_in_bad"] += 1
+            continue
+        bad, seen, assembly, good, contigs = process_overlap(seen, good, assembly, bad, report, contigs, overlap)
+        if last_query == query_name and previous_ref == ref_name and ref_name in seen:
+            seen, bad, processed = clear_multiple_matches(ref_name, query_name, seen, bad, processed)
+        last_query = query_name
+
+    if stats is not None and group_rows:
+        candidates = stats.candidates(seen)
+    if last_ref >= 0:
+        if stamped:
+            report.stamp = assembly.stamp = (flush_index, 0)
+        seen, assembly, good, bad, last_ref, contigs, covers, processed = find_longest_extension(seen, good, bad, report, assembly, last_ref, contigs, covers, processed)
+    if stats is not None and group_rows:
+        stats.end_group(group_ref, group_rows, candidates, group_start, good, bad, covers, processed)
+    return assembly, contigs, good
+
+class StampedReport(list):
+    '''report for a worker process. Each event is kept with the stamp of the serial position it was reported at, and written out by the main process.'''
+    def __init__(self, level=2):
+        list.__init__(self)
+        self.stamp = None
+        self.level = level
+
+    def add(self, *event):
+        if self.level >= report_event_levels[event[0]]:
+            self.append((self.stamp, len(self), event))
+
+class StampedAssembly(OrderedDict):
+    '''assembly for a worker process. Records the serial position at which each contig was (re)inserted, which decides its place in the output fasta.'''
+    def __init__(self, *args, **kwargs):
+        self.stamp = None
+        self.inserted = {}
+        OrderedDict.__init__(self, *args, **kwargs)
+
+    def __setitem__(self, key, value, *args):
+        if key not in self and self.stamp is not None:
+            self.inserted[key] = (self.stamp, len(self.inserted))
+        OrderedDict.__setitem__(self, key, value, *args)
+
+class PassThroughAssembly(OrderedDict):
+    '''assembly of a --pass-through run, holding only the contigs named in the overlap file. inserted is the set of contigs (re)inserted since loading.
+    In a full run those end up after all the fasta\'s contigs while the rest keep their fasta position, so write_assembly places them the same way around the contigs it streams through.'''
+    def __init__(self, items=(), inserted=()):
+        self.inserted = None
+        OrderedDict.__init__(self, items)
+        self.inserted = set(inserted)
+
+    def __setitem__(self, key, value, *args):
+        if self.inserted is not None and key not in self:
+            self.inserted.add(key)
+        OrderedDict.__setitem__(self, key, value, *args)
+
+def overlap_components(records):
+    '''Splits the records into connected components of the contig overlap graph. Records that can not change any state (self hits and low identity) are dropped.
+    Returns a list of record lists with each record carrying the index at which the serial run resolves its reference group.'''
+    parent = {}
+    def find(name):
+        root = name
+        while parent[root] != root:
+            root = parent[root]
+        while parent[name] != root:
+            parent[name], name = root, parent[name]
+        return root
+    
+    kept = []
+    next_run_index = {}
+    last_run = None
+    min_identity = thresholds.min_identity
+    for index, run, flush_index, overlap in records:
+        if run != last_run:
+            next_run_index[last_run] = index
+            last_run = run
+        ref_name = overlap.ref_name
+        query_name = overlap.query_name
+        if ref_name == query_name or overlap.percent_id <= min_identity:
+            if merge_stats is not None:
+                merge_stats.dropped["self_hit" if ref_name == query_name else "low_identity"] += 1
+            continue
+        kept.append((index, run, overlap))
+        for name in (ref_name, query_name):
+            if name not in parent:
+                parent[name] = name
+        ref_root = find(ref_name)
+        query_root = find(query_name)
+        if ref_root != query_root:
+            parent[query_root] = ref_root
+    next_run_index[last_run] = index + 1 if last_run is not None else 0
+    
+    components = OrderedDict()
+    for index, run, overlap in kept:
+        root = find(overlap.ref_name)
+        if root not in components:
+            components[root] = []
+        components[root].append((index, run, next_run_index[run], overlap))
+    return components.values()
+
+def read_checkpoint(path):
+    '''Returns the state saved at path, or None if there is no checkpoint file. It is read before the fasta is loaded so the prefilter result in it can be reused, but only if checkpoint_inputs still match; Checkpoint.check then makes sure the rest fits.'''
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return cPickle.load(f)
+
+def checkpoint_inputs(overlap_file, fasta_file, options):
+    '''Returns the inputs a checkpoint is made for: the size and time of the overlap and fasta files followed by the options and thresholds the state depends on.
+    With overlap_file None the overlap file's entry is left out, which is all that can be checked before a --find-overlaps run has written it.'''
+    paths = (overlap_file, fasta_file) if overlap_file is not None else (fasta_file,)
+    inputs = [(os.path.abspath(path), os.path.getsize(path), os.path.getmtime(path)) for path in paths]
+    inputs += [options[key] for key in ("unsorted", "numpy", "report_format", "report_level", "prefilter", "prefilter_k", "prefilter_containment", "prefilter_scale", "pass_through")]
+    inputs += thresholds.values()
+    return inputs
+
+class Checkpoint(object):
+    '''Saves the merge state to path at most every interval seconds, between reference groups, and loads it back for --resume.
+    inputs identifies the overlap and fasta files and the options the state depends on; a checkpoint made for other inputs is refused.
+    position is the list read_overlap_records keeps the byte offset of the current record in, or None when the overlap input can not be seeked into.'''
+    def __init__(self, path, interval, inputs, position=None):
+        self.path = path
+        self.interval = interval
+        self.inputs = inputs
+        self.position = position
+        self.base = {}
+        self.contained = []
+        self.last = time.time()
+
+    def due(self):
+        return time.time() - self.last >= self.interval
+
+    def save(self, index, assembly, contigs, good, bad, covers, processed, report):
+        '''Writes the state as it is before record index. Only contigs whose sequence differs from the fasta view in base are stored; the rest are mapped again on resume.'''
+        base = self.base
+        overlays = {}
+        for name, seq in assembly.iteritems():
+            if seq is not base.get(name):
+                overlays[name] = seq
+        state = {
+            "inputs": self.inputs,
+            "index": index,
+            "offset": self.position[0] if self.position is not None else None,
+            "names": contig_names.names,
+            "order": list(assembly),
+            "inserted": list(getattr(assembly, "inserted", ())),
+            "overlays": overlays,
+            "contigs": contigs.items(),
+            "good": (good.ref.tostring(), str(good.ref_end), str(good.query_end), good.ori.tostring()),
+            "bad": str(bad),
+            "covers": covers.tostring(),
+            "processed": str(processed),
+            "report": report.checkpoint(),
+            "contained": self.contained,
+        }
+        temp = self.path + ".tmp"
+        with open(temp, "wb") as f:
+            cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(temp, self.path)
+        self.last = time.time()
+
+    def check(self, state):
+        '''Returns state, read from the checkpoint file with read_checkpoint, after making sure it was made for these inputs.'''
+        if state is None:
+            return None
+        if state["inputs"] != self.inputs:
+            print "Checkpoint", self.path, "was made for other input files or options."
+            sys.exit(-1)
+        return state
+
+    def restore(self, state, assembly, good, bad, covers, processed):
+        '''Puts a loaded state back into the tables and returns the assembly and contigs dictionaries. assembly is the freshly loaded fasta.'''
+        names = state["names"]
+        if names[:len(contig_names.names)] != contig_names.names:
+            print "Checkpoint", self.path, "does not match the contig names in the fasta file."
+            sys.exit(-1)
+        for name in names[len(contig_names.names):]:
+            contig_names.id(name)
+        good_ref, good_ref_end, good_query_end, good_ori = state["good"]
+        good.ref[:] = array("l", good_ref)
+        good.ref_end[:] = good_ref_end
+        good.query_end[:] = good_query_end
+        good.ori[:] = array("b", good_ori)
+        bad[:] = state["bad"]
+        covers[:] = array("l", state["covers"])
+        processed[:] = state["processed"]
+        overlays = state["overlays"]
+        restored = OrderedDict()
+        for name in state["order"]:
+            restored[name] = overlays[name] if name in overlays else assembly[name]
+        if isinstance(assembly, PassThroughAssembly):
+            restored = PassThroughAssembly(restored, state["inserted"])
+        return restored, OrderedDict(state["contigs"])
+
+def merge_tables():
+    '''Returns empty good, bad, covers and processed tables sized to contig_names. They grow with it until release_merge_tables.'''
+    return GoodTable(contig_names), contig_names.flags(), contig_names.refs(), contig_names.flags()
+
+def release_merge_tables(tables):
+    '''Hands tables from merge_tables back once their merge is over, so contig_names stops growing them.'''
+    good, bad, covers, processed = tables
+    contig_names.release(good.ref, good.ref_end, good.query_end, good.ori, bad, covers, processed)
+
+_parallel_state = None
+_worker_tables = None
+
+def merge_component(records):
+    '''Worker for merge_overlaps_parallel. Merges one component of the overlap graph and returns its final state with serial position stamps.
+    The id-indexed tables are made once per worker process and the component's slots are reset before returning.'''
+    global _worker_tables
+    assembly, contigs, fasta_order, report_level = _parallel_state
+    if _worker_tables is None:
+        _worker_tables = merge_tables()
+        release_merge_tables(_worker_tables)
+    good, bad, covers, processed = _worker_tables
+    touched = set()
+    for index, run, next_run_index, overlap in records:
+        touched.add(overlap.ref_name)
+        touched.add(overlap.query_name)
+    names = sorted([name for name in touched if name in fasta_order], key=fasta_order.get)
+    comp_assembly = StampedAssembly()
+    comp_contigs = OrderedDict()
+    for name in names:
+        if name in assembly:
+            comp_assembly[name] = assembly[name]
+        if name in contigs:
+            comp_contigs[name] = contigs[name].copy()
+    report = StampedReport(report_level)
+    merge_overlaps(records, comp_assembly, comp_contigs, good, bad, covers, processed, report, stamped=True)
+    comp_good = []
+    for contig in touched:
+        if good.ref[contig] >= 0:
+            comp_good.append((contig, good.ref[contig], good.ref_end[contig], good.query_end[contig], good.ori[contig]))
+        bad[contig] = 0
+        covers[contig] = -1
+        processed[contig] = 0
+        good.ref[contig] = -1
+    kept = []
+    inserted = []
+    for name, seq in comp_assembly.iteritems():
+        if name in comp_assembly.inserted:
+            inserted.append((comp_assembly.inserted[name], name, seq))
+        else:
+            kept.append((name, seq))
+    comp_stats = merge_stats.take() if merge_stats is not None else None
+    return names, kept, inserted, comp_contigs.items(), comp_good, list(report), comp_stats
+
+def merge_overlaps_parallel(records, assembly, contigs, good, report, threads):
+    '''Merges the connected components of the overlap graph in a pool of threads worker processes.
+    The results are put back together in the order the serial run would have produced them, so the output is identical to merge_overlaps.'''
+    global _parallel_state
+    components = overlap_components(records)
+    components.sort(key=len, reverse=True)
+    fasta_order = {}
+    for i, name in enumerate(assembly):
+        fasta_order[name] = i
+    _parallel_state = (assembly, contigs, fasta_order, report.level)
+    if merge_stats is not None:
+        parent_stats = merge_stats.take()
+    pool = multiprocessing.Pool(threads)
+    try:
+        results = pool.imap_unordered(merge_component, components, max(1, len(components) // (threads * 8)))
+        touched = set()
+        kept = {}
+        inserted = []
+        reports = []
+        for names, comp_kept, comp_inserted, comp_contigs, comp_good, comp_report, comp_stats in results:
+            touched.update(names)
+            kept.update(comp_kept)
+            inserted.extend(comp_inserted)
+            for name in names:
+                contigs.pop(name, None)
+            contigs.update(comp_contigs)
+            for entry in comp_good:
+                good.set(*entry)
+            reports.extend(comp_report)
+            if comp_stats is not None:
+                merge_stats.add(comp_stats)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        _parallel_state = None
+    if merge_stats is not None:
+        merge_stats.add(parent_stats)
+    
+    merged = OrderedDict()
+    for name, seq in assembly.iteritems():
+        if name not in touched:
+            merged[name] = seq
+        elif name in kept:
+            merged[name] = kept[name]
+    if isinstance(assembly, PassThroughAssembly):
+        merged = PassThroughAssembly(merged)
+    inserted.sort(key=itemgetter(0))
+    for stamp, name, seq in inserted:
+        merged[name] = seq
+    reports.sort(key=itemgetter(0, 1))
+    for stamp, order, event in reports:
+        report.add(*event)
+    return merged, contigs, good
+
+def report_leftover_good(good, assembly, contigs, report):
+    '''Reports the contigs still in good after the merge and drops them from assembly and contigs.'''
+    for item in good.contigs():
+        ref, ref_end, query_end, ori = good.entry(item)
+        value = ",".join([ref_end, query_end, str(ori)])
         if item not in contigs:
-            report_list.append(item + "\t" + "Still in good but not contigs after processing\n")
+            report.add(STILL_IN_GOOD_NOT_CONTIGS, good.ref[item], -1, item, -1, value)
         else:
-            report_list.append(item + "\t" + "Still in good and contigs after processing\n")
-        report_list.append(good[item])
+            report.add(STILL_IN_GOOD, good.ref[item], -1, item, -1, value)
         assembly.pop(item, None)
         contigs.pop(item, None)
-        
-    with open(bad_out, "w", 1) as out:
-        for item in report_list:
-            print>>out, item
-    report_list = []
-    
-    assembly_out = os.path.splitext(sys.argv[2])[0] + "_" + sys.argv[3] + ".fa"
-    with open(assembly_out, "w", 1) as out:
+
+def write_assembly(assembly, assembly_file, line_width=0, compress="", fasta_file=None):
+    '''Writes assembly to assembly_file. A PassThroughAssembly is written while streaming fasta_file: its contigs that were never loaded go straight through, in their place.
+    Returns (name, length) of the contigs streamed through.'''
+    names = contig_names.names
+    passed = []
+    with FastaWriter(assembly_file, line_width, compress) as out:
+        if not isinstance(assembly, PassThroughAssembly):
+            for title in assembly:
+                out.write(names[title], assembly[title])
+            return passed
+        ids = contig_names.ids
+        loaded = contig_names.loaded
+        inserted = assembly.inserted
+        for title, seq in fasta_records(fasta_file, lambda name: ids.get(name, loaded) >= loaded):
+            if seq is not None:
+                out.write(title, seq)
+                passed.append((title, len(seq)))
+            elif ids[title] in assembly and ids[title] not in inserted:
+                out.write(title, assembly[ids[title]])
         for title in assembly:
-            print>>out, ">" + title + "\n" + assembly[title]
-    assembly = {}
-    
-    newdct = []
-    for key in contigs:
-        newdct.append(key)
-    newdct.sort()       
-    with open(contigs_out, "w", 1) as out:
-        for item in newdct:
-            print>>out, item + "\t" + "\t".join(contigs[item])
-    
-	return 0
+            if title in inserted:
+                out.write(names[title], assembly[title])
+    return passed
+
+def write_contigs(contigs, contigs_file, passed=(), gfa_file=""):
+    '''Writes the contigs dictionary with write_paths. passed are (name, length) of contigs streamed through unchanged.
+    Returns the output contigs as a list of (output name, [(input name, input length, ori), ...]), sorted by name.'''
+    names = contig_names.names
+    lengths = contig_names.lengths
+    paths = [(names[item], [(names[x], lengths[x], ori) for x, ori in contigs[item].members()]) for item in contigs]
+    paths.extend([(name, [(name, length, 1)]) for name, length in passed])
+    paths.sort(key=itemgetter(0))
+    write_paths(paths, contigs_file, gfa_file)
+    return paths
+
+def write_paths(paths, contigs_file, gfa_file=""):
+    '''Writes one line per output contig of paths, a list of (output name, [(input name, input length, ori), ...]): its name, then the input contigs it was built from.
+    With gfa_file the same output contigs are written there as GFA 1 paths, one S line per input contig and one P line per output contig giving its input contigs with their orientations.'''
+    with open(contigs_file, "w", OUTPUT_BUFFER) as out:
+        for name, members in paths:
+            print>>out, name + "\t" + "\t".join([part for part, length, ori in members])
+    if gfa_file:
+        with open(gfa_file, "w", OUTPUT_BUFFER) as out:
+            print>>out, "H\tVN:Z:1.0"
+            for name, members in paths:
+                for part, length, ori in members:
+                    print>>out, "S\t%s\t*\tLN:i:%d" % (part, length)
+            for name, members in paths:
+                print>>out, "P\t%s\t%s\t*" % (name, ",".join([part + ("+" if ori == 1 else "-") for part, length, ori in members]))
+
+def output_paths(args, options, suffix=""):
+    '''Returns the report, contigs and fasta output paths for the command line arguments, named after the inputs or --output-prefix. suffix is added to the run name.'''
+    run_name = args[2] + suffix
+    overlap_base = options["output_prefix"] or os.path.splitext(args[0])[0]
+    fasta_base = options["output_prefix"] or os.path.splitext(args[1])[0]
+    bad_out = overlap_base + "_" + run_name + "_report" + report_extensions[options["report_format"]]
+    contigs_out = overlap_base + "_" + run_name + "_contigs.out"
+    assembly_out = fasta_base + "_" + run_name + ".fa"
+    if options["compress"]:
+        assembly_out += ".gz"
+    return bad_out, contigs_out, assembly_out
+
+def prepare_assembly(overlap_file, fasta_file, options, contained=None):
+    '''Loads fasta_file, or with --pass-through only the contigs named in overlap_file, and runs the containment prefilter and the built-in overlap finder if they are on.
+    contained is the prefilter\'s result saved in a checkpoint being resumed, which is used instead of running it again.
+    Returns the assembly and contigs dictionaries and the prefilter's list of (contig, container, coverage).'''
+    if options["pass_through"]:
+        assembly, contigs = load_assembly(fasta_file, overlap_contig_names(overlap_file, options["decompress_threads"]))
+        assembly = PassThroughAssembly(assembly)
+        print "Loaded", len(assembly), "contigs named in the overlap file."
+        return assembly, contigs, []
+    assembly, contigs = load_assembly(fasta_file)
+    if not options["prefilter"]:
+        contained = []
+    elif contained is None:
+        contained = contained_contigs(assembly, options["prefilter_k"], options["prefilter_containment"], options["prefilter_scale"])
+        print "Prefilter found", len(contained), "contained contigs."
+    else:
+        print "Prefilter found", len(contained), "contained contigs (from the checkpoint)."
+    if options["find_overlaps"] and not (options["resume"] and os.path.exists(overlap_file)):
+        kept = OrderedDict(assembly)
+        for contig, container, coverage in contained:
+            del kept[contig]
+        rows = find_overlaps(kept, **finder_options(options))
+        write_overlap_file(rows, overlap_file, fasta_file + " " + fasta_file)
+        print "Found", len(rows), "overlap lines."
+    return assembly, contigs, contained
+
+def drop_contained(contained, assembly, contigs, report):
+    '''Removes the contigs the prefilter found from assembly and contigs and reports them as covered.'''
+    for contig, container, coverage in contained:
+        assembly.pop(contig, None)
+        contigs.pop(contig, None)
+        report.add(COVERED_100 if coverage == 100 else COVERED_98, container, -1, contig)
+
+def merge_records(records, assembly, contigs, tables, report, options, checkpoint=None):
+    '''Merges records into assembly and contigs with the good, bad, covers and processed tables, in options["threads"] processes, then reports and drops what is left in good.
+    Returns the merged assembly and contigs. The tables are released when it is done.'''
+    good, bad, covers, processed = tables
+    if options["threads"] > 1:
+        assembly, contigs, good = merge_overlaps_parallel(list(records), assembly, contigs, good, report, options["threads"])
+    else:
+        assembly, contigs, good = merge_overlaps(records, assembly, contigs, good, bad, covers, processed, report, checkpoint=checkpoint)
+    if merge_stats is not None:
+        merge_stats.sample(good, bad, covers, processed)
+    report_leftover_good(good, assembly, contigs, report)
+    release_merge_tables(tables)
+    return assembly, contigs
+
+def write_outputs(assembly, contigs, outputs, options, fasta_file):
+    '''Writes the fasta and contigs files named in outputs, and the --stats summary. fasta_file is the input a --pass-through run streams from.
+    Returns the output contigs as a dictionary of output name: [(input name, input length, ori), ...].'''
+    bad_out, contigs_out, assembly_out = outputs
+    passed = write_assembly(assembly, assembly_out, options["line_width"], options["compress"], fasta_file)
+    gfa_out = ""
+    if options["gfa"]:
+        gfa_out = os.path.splitext(contigs_out)[0] + ".gfa"
+    paths = write_contigs(contigs, contigs_out, passed, gfa_out)
+    
+    if merge_stats is not None:
+        with open(options["stats"], "w") as out:
+            json.dump(merge_stats.summary(), out, indent=2)
+            out.write("\n")
+    
+    return OrderedDict(paths)
+
+def assemble(overlap_file, fasta_file, outputs, options):
+    '''Runs the whole merge of overlap_file into fasta_file under thresholds and writes the report, contigs and fasta files named in outputs.
+    Returns the output contigs as a dictionary of output name: [(input name, input length, ori), ...].'''
+    bad_out, contigs_out, assembly_out = outputs
+    
+    saved = read_checkpoint(options["checkpoint"]) if options["resume"] else None
+    contained = None
+    if saved is not None and saved["inputs"][1:] == checkpoint_inputs(None, fasta_file, options):
+        contained = saved.get("contained")
+    assembly, contigs, contained = prepare_assembly(overlap_file, fasta_file, options, contained)
+    
+    checkpoint = None
+    state = None
+    position = None
+    if options["checkpoint"]:
+        if not options["unsorted"] and not options["numpy"] and not is_compressed(overlap_file):
+            position = [0]
+        checkpoint = Checkpoint(options["checkpoint"], options["checkpoint_interval"], checkpoint_inputs(overlap_file, fasta_file, options), position)
+        checkpoint.base = dict(assembly)
+        checkpoint.contained = contained
+        if options["resume"]:
+            state = checkpoint.check(saved)
+            if state is None:
+                print "No checkpoint found at", options["checkpoint"] + ", starting from the beginning."
+    tables = merge_tables()
+    if state is not None:
+        assembly, contigs = checkpoint.restore(state, assembly, *tables)
+    
+    reader = read_overlap_records
+    if options["numpy"]:
+        reader = read_overlap_records_numpy
+    
+    with open_input(overlap_file, options["decompress_threads"]) as f, ReportWriter(bad_out, options["report_format"], options["report_level"], resume=state["report"] if state else None) as report:
+        removed = contig_names.flags()
+        for contig, container, coverage in contained:
+            removed[contig] = 1
+        if state is None:
+            drop_contained(contained, assembly, contigs, report)
+        if state is not None and position is not None:
+            f.seek(state["offset"])
+            records = read_overlap_records(f, state["index"], False, position)
+        elif options["unsorted"]:
+            records = reader(grouped_overlap_lines(overlap_file, options["decompress_threads"]))
+        elif position is not None:
+            records = read_overlap_records(f, position=position)
+        else:
+            records = reader(f)
+        if state is not None and position is None:
+            records = skip_records(records, state["index"])
+        if contained:
+            records = drop_contained_records(records, removed)
+        assembly, contigs = merge_records(records, assembly, contigs, tables, report, options, checkpoint)
+        contig_names.release(removed)
+    
+    merged = write_outputs(assembly, contigs, outputs, options, fasta_file)
+    if checkpoint is not None and os.path.exists(checkpoint.path):
+        os.remove(checkpoint.path)
+    return merged
+
+def assemble_sweep(args, options, sets):
+    '''Merges the overlap file into the fasta file once under each Thresholds of sets, writing each set\'s report, contigs and fasta files with _<name> added to the run name.
+    The overlap file is read and parsed only once, keeping every line the set with the lowest min_identity would, and the records are kept in memory for all the merges.'''
+    global thresholds
+    overlap_file, fasta_file = args[0], args[1]
+    thresholds = min(sets, key=attrgetter("min_identity"))
+    assembly, contigs, contained = prepare_assembly(overlap_file, fasta_file, options)
+    removed = contig_names.flags()
+    for contig, container, coverage in contained:
+        removed[contig] = 1
+    
+    reader = read_overlap_records
+    if options["numpy"]:
+        reader = read_overlap_records_numpy
+    with open_input(overlap_file, options["decompress_threads"]) as f:
+        if options["unsorted"]:
+            records = reader(grouped_overlap_lines(overlap_file, options["decompress_threads"]))
+        else:
+            records = reader(f)
+        if contained:
+            records = drop_contained_records(records, removed)
+        records = list(records)
+    contig_names.release(removed)
+    print "Read", len(records), "overlap lines."
+    
+    stats_file = os.path.splitext(options["stats"])
+    for threshold_set in sets:
+        thresholds = threshold_set
+        suffix = "_" + threshold_set.name
+        set_options = OrderedDict(options)
+        if merge_stats is not None:
+            merge_stats.restart()
+            set_options["stats"] = stats_file[0] + suffix + stats_file[1]
+        outputs = output_paths(args, set_options, suffix)
+        if isinstance(assembly, PassThroughAssembly):
+            set_assembly = PassThroughAssembly(assembly)
+        else:
+            set_assembly = OrderedDict(assembly)
+        set_contigs = OrderedDict([(contig, path.copy()) for contig, path in contigs.iteritems()])
+        with ReportWriter(outputs[0], options["report_format"], options["report_level"]) as report:
+            drop_contained(contained, set_assembly, set_contigs, report)
+            set_assembly, set_contigs = merge_records(records, set_assembly, set_contigs, merge_tables(), report, options)
+        merged = write_outputs(set_assembly, set_contigs, outputs, set_options, fasta_file)
+        print "Thresholds", threshold_set.name, "gave", len(merged), "contigs."
+
+def mirror_overlap_fields(fields):
+    '''Returns the 16 fields of a nucmer tab line with the reference and query swapped.'''
+    ref_start, ref_end, query_start, query_end, ref_align_len, query_align_len, percent_id, ref_len, query_len, ref_coverage, query_coverage, frame, strand, ref_name, query_name, tag = fields
+    if int(query_start) <= int(query_end):
+        coords = [query_start, query_end, ref_start, ref_end]
+    else:
+        coords = [query_end, query_start, ref_end, ref_start]
+    if "IDENTITY" in tag:
+        new_tag = tag
+    elif "CONTAINED" in tag:
+        new_tag = "[CONTAINS]"
+    elif "CONTAINS" in tag:
+        new_tag = "[CONTAINED]"
+    else:
+        tags = []
+        if int(coords[0]) == 1:
+            tags.append("[BEGIN]")
+        if int(coords[1]) == int(query_len):
+            tags.append("[END]")
+        new_tag = " ".join(tags) or tag
+    return coords + [query_align_len, ref_align_len, percent_id, query_len, ref_len, query_coverage, ref_coverage, frame, strand, query_name, ref_name, new_tag]
+
+def overlap_seeds(seq, k, sample):
+    '''Yields (position, k-mer) for every k-mer of seq whose hash is a multiple of sample. The choice only depends on the k-mer, so two copies of a region share their seeds.'''
+    for i in xrange(len(seq) - k + 1):
+        kmer = seq[i:i + k]
+        if hash(kmer) % sample == 0:
+            yield i, kmer
+
+def diagonal_clusters(diagonals, band, min_seeds):
+    '''Groups the sorted seed diagonals of one contig pair into runs no more than band apart and yields the median diagonal of each run with at least min_seeds seeds.'''
+    cluster = [diagonals[0]]
+    for diagonal in diagonals[1:]:
+        if diagonal - cluster[-1] <= band:
+            cluster.append(diagonal)
+            continue
+        if len(cluster) >= min_seeds:
+            yield cluster[len(cluster) // 2]
+        cluster = [diagonal]
+    if len(cluster) >= min_seeds:
+        yield cluster[len(cluster) // 2]
+
+def banded_identity(x, y, band):
+    '''Returns the percent identity of the best global alignment of x and y with every gap within band of the diagonal, or 0.0 if their lengths differ by more than band.'''
+    n, m = len(x), len(y)
+    if abs(n - m) > band:
+        return 0.0
+    worst = n + m
+    previous = [j if j <= band else worst for j in xrange(m + 1)]
+    for i in xrange(1, n + 1):
+        current = [worst] * (m + 1)
+        if i <= band:
+            current[0] = i
+        base = x[i - 1]
+        for j in xrange(max(1, i - band), min(m, i + band) + 1):
+            cost = previous[j - 1] + (base != y[j - 1])
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost
+        previous = current
+    return 100.0 * (max(n, m) - previous[m]) / max(n, m)
+
+def overlap_tag(ref_start, ref_end, ref_len, query_align_len, query_len):
+    '''Returns the show-coords -o tag of an alignment covering ref_start..ref_end (1-based) of the reference and query_align_len bases of the query.'''
+    ref_align_len = ref_end - ref_start + 1
+    if ref_align_len == ref_len and query_align_len == query_len:
+        return "[IDENTITY]"
+    if query_align_len == query_len:
+        return "[CONTAINS]"
+    if ref_align_len == ref_len:
+        return "[CONTAINED]"
+    tags = []
+    if ref_start == 1:
+        tags.append("[BEGIN]")
+    if ref_end == ref_len:
+        tags.append("[END]")
+    return " ".join(tags)
+
+def find_overlaps(assembly, only=None, k=15, window=500, min_overlap=40, min_identity=95.0, sample=4, band=8, min_seeds=2, max_occurrences=64):
+    '''Finds the end overlaps and contained contigs of assembly without an external aligner. Returns them as lists of the 16 nucmer tab fields, every overlap from both sides as an all-vs-all nucmer run gives them, sorted by reference.
+    Seeds are only indexed from the window bases at each end of a contig, as any overlap merge_overlaps can use touches one of them, and are looked up along both strands of every whole contig. Each run of seeds on one diagonal is checked over the full overlap it implies, by comparison or banded alignment.
+    With only, a set of ids, just the overlaps involving one of those contigs are returned.'''
+    names = contig_names.names
+    lengths = {}
+    index = {}
+    for contig, seq in assembly.iteritems():
+        length = lengths[contig] = len(seq)
+        if length <= 2 * window:
+            windows = ((0, seq[:]),)
+        else:
+            windows = ((0, seq[:window]), (length - window, seq[length - window:]))
+        for offset, bases in windows:
+            for i, kmer in overlap_seeds(bases.upper(), k, sample):
+                index.setdefault(kmer, []).append((contig, offset + i))
+    
+    found = {}
+    for contig, seq in assembly.iteritems():
+        bases = seq[:].upper()
+        length = len(bases)
+        for strand, strand_bases in ((1, bases), (-1, reverse_complement(bases))):
+            diagonals = {}
+            for i, kmer in overlap_seeds(strand_bases, k, sample):
+                hits = index.get(kmer)
+                if hits is None or len(hits) > max_occurrences:
+                    continue
+                for other, j in hits:
+                    if other == contig or (only is not None and contig not in only and other not in only):
+                        continue
+                    # Offset of other (on this strand) against contig, in contig's forward coordinates
+                    if strand == 1:
+                        diagonals.setdefault(other, []).append(i - j)
+                    else:
+                        diagonals.setdefault(other, []).append(j - i + length - lengths[other])
+            for other in sorted(diagonals):
+                other_len = lengths[other]
+                other_bases = None
+                for diagonal in diagonal_clusters(sorted(diagonals[other]), band, min_seeds):
+                    ref_start, ref_end = max(0, diagonal), min(length, diagonal + other_len)
+                    if ref_end - ref_start < min_overlap:
+                        continue
+                    accepted = found.setdefault((contig, other, strand), [])
+                    if any(abs(ref_start - start) <= band and abs(ref_end - end) <= band for start, end, fields in accepted):
+                        continue
+                    if other_bases is None:
+                        other_bases = assembly[other][:].upper()
+                        if strand == -1:
+                            other_bases = reverse_complement(other_bases)
+                    ref_seq = bases[ref_start:ref_end]
+                    query_seq = other_bases[ref_start - diagonal:ref_end - diagonal]
+                    identity = 100.0 if ref_seq == query_seq else banded_identity(ref_seq, query_seq, band)
+                    if identity < min_identity:
+                        continue
+                    align_len = ref_end - ref_start
+                    if strand == 1:
+                        query_start, query_end = ref_start - diagonal + 1, ref_end - diagonal
+                    else:
+                        query_start, query_end = other_len - (ref_start - diagonal), other_len - (ref_end - diagonal) + 1
+                    fields = [str(value) for value in (ref_start + 1, ref_end, query_start, query_end, align_len, align_len)]
+                    fields += ["%.2f" % identity, str(length), str(other_len), "%.2f" % (100.0 * align_len / length), "%.2f" % (100.0 * align_len / other_len), "1", str(strand), names[contig], names[other], overlap_tag(ref_start + 1, ref_end, length, align_len, other_len)]
+                    mirrored = mirror_overlap_fields(fields)
+                    accepted.append((ref_start, ref_end, fields))
+                    found.setdefault((other, contig, strand), []).append((int(mirrored[0]) - 1, int(mirrored[1]), mirrored))
+    
+    rows = [fields for accepted in found.itervalues() for start, end, fields in accepted]
+    rows.sort(key=lambda fields: (fields[13], int(fields[0]), fields[14]))
+    return rows
+
+def finder_options(options):
+    '''Returns the find_overlaps keyword arguments set on the command line.'''
+    return dict(k=options["overlap_k"], window=options["overlap_window"], min_overlap=options["overlap_min"])
+
+def write_overlap_file(rows, overlap_file, header):
+    '''Writes header and then the rows of 16 nucmer tab fields to overlap_file.'''
+    with open(overlap_file, "w", OUTPUT_BUFFER) as out:
+        print>>out, header
+        for fields in rows:
+            print>>out, "\t".join(fields)
+
+def realign(fasta_file, changed, overlap_file, aligner, finder_options=None):
+    '''Aligns the changed contigs of fasta_file against all of it with the aligner command and writes the overlaps to overlap_file, sorted by reference.
+    The aligner only reports changed contigs as queries, so each of its lines with an unchanged reference is also written mirrored, giving every overlap from both sides as an all-vs-all run would.
+    If aligner is "native", find_overlaps is run with finder_options instead, restricted to the changed contigs.'''
+    assembly, contigs = load_assembly(fasta_file)
+    ids = contig_names.ids
+    if aligner == "native":
+        rows = find_overlaps(assembly, only=set(ids[name] for name in changed if name in ids), **(finder_options or {}))
+        write_overlap_file(rows, overlap_file, fasta_file + " " + fasta_file)
+        return len(rows)
+    prefix = os.path.splitext(overlap_file)[0]
+    query_file = prefix + "_query.fa"
+    with FastaWriter(query_file) as out:
+        for name in changed:
+            if ids.get(name) in assembly:
+                out.write(name, assembly[ids[name]])
+    aligned_file = prefix + "_aligned.tab"
+    command = aligner.format(ref=fasta_file, query=query_file, prefix=prefix, out=aligned_file)
+    if subp.call(command, shell=True) != 0:
+        print "Aligner command failed:", command
+        sys.exit(-1)
+    changed = set(changed)
+    rows = []
+    with open(aligned_file, "r") as f:
+        for line in f:
+            fields = line.rstrip("\r\n").split("\t")
+            if len(fields) != 16 or not fields[0].isdigit():
+                continue
+            rows.append(fields)
+            if fields[13] not in changed:
+                rows.append(mirror_overlap_fields(fields))
+    rows.sort(key=lambda fields: (fields[13], int(fields[0])))
+    write_overlap_file(rows, overlap_file, fasta_file + " " + query_file)
+    os.remove(query_file)
+    return len(rows)
+
+def assemble_rounds(args, options):
+    '''Runs assemble round after round. Each round\'s merged or extended contigs are realigned against that round\'s output and merged again, until a round changes nothing or options["rounds"] is reached.
+    Every round writes its own report, contigs and fasta files with _round<n> added to the run name. The last round\'s fasta and the contigs traced back to the input names are then written to the usual output files.
+    A part that a round put in reverse brings its own members in with their order and orientations turned round.'''
+    overlap_file, fasta_file = args[0], args[1]
+    bad_out, contigs_out, assembly_out = output_paths(args, options)
+    round_options = OrderedDict(options)
+    round_options["compress"] = ""
+    stats_file = os.path.splitext(options["stats"])
+    origins = None
+    for round_number in xrange(1, options["rounds"] + 1):
+        suffix = "_round%d" % round_number
+        if merge_stats is not None:
+            merge_stats.restart()
+            round_options["stats"] = stats_file[0] + suffix + stats_file[1]
+        outputs = output_paths(args, round_options, suffix)
+        merged = assemble(overlap_file, fasta_file, outputs, round_options)
+        changed = [name for name, parts in merged.iteritems() if len(parts) > 1]
+        if origins is None:
+            origins = merged
+        else:
+            for name, parts in merged.iteritems():
+                traced = []
+                for part, length, ori in parts:
+                    if ori == 1:
+                        traced.extend(origins[part])
+                    else:
+                        traced.extend([(origin, origin_length, -origin_ori) for origin, origin_length, origin_ori in reversed(origins[part])])
+                merged[name] = traced
+            origins = merged
+        fasta_file = outputs[2]
+        print "Round", round_number, "merged", len(changed), "contigs."
+        if not changed or round_number == options["rounds"]:
+            break
+        overlap_file = os.path.splitext(outputs[2])[0] + "_next.tab"
+        realign(fasta_file, changed, overlap_file, options["aligner"], finder_options(options))
+        round_options["find_overlaps"] = False
+    
+    assembly, contigs = load_assembly(fasta_file)
+    write_assembly(assembly, assembly_out, options["line_width"], options["compress"])
+    gfa_out = ""
+    if options["gfa"]:
+        gfa_out = os.path.splitext(contigs_out)[0] + ".gfa"
+    write_paths(sorted(origins.items()), contigs_out, gfa_out)
+
+def main():
+    global thresholds
+    args, options = parse_args(sys.argv[1:])
+    if options["numpy"] and numpy is None:
+        print "--numpy needs the numpy module, which could not be imported."
+        sys.exit(-1)
+    if options["pyinstrument"] and pyinstrument is None:
+        print "--pyinstrument needs the pyinstrument module, which could not be imported."
+        sys.exit(-1)
+    if args[0] == "-" and not options["output_prefix"]:
+        print "Reading the overlap lines from stdin needs --output-prefix."
+        sys.exit(-1)
+    if is_stream(args[0]) and (options["unsorted"] or options["pass_through"] or options["checkpoint"] or options["find_overlaps"]):
+        print "Overlap lines from stdin or a pipe can only be read once, so --unsorted, --pass-through, --checkpoint and --find-overlaps are not available."
+        sys.exit(-1)
+    if options["stats"]:
+        enable_stats()
+    sets = threshold_sets(options)
+    if len(sets) > 1 and (options["checkpoint"] or options["rounds"] > 1):
+        print "A --thresholds sweep can not be run with --checkpoint or --rounds."
+        sys.exit(-1)
+    
+    thresholds = sets[0]
+    if len(sets) > 1:
+        run, run_args = assemble_sweep, (args, options, sets)
+    elif options["rounds"] > 1:
+        run, run_args = assemble_rounds, (args, options)
+    else:
+        run, run_args = assemble, (args[0], args[1], output_paths(args, options), options)
+    
+    if options["cprofile"]:
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(run, *run_args)
+        finally:
+            profiler.dump_stats(options["cprofile"])
+    elif options["pyinstrument"]:
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+        try:
+            run(*run_args)
+        finally:
+            profiler.stop()
+            with open(options["pyinstrument"], "w") as out:
+                out.write(profiler.output_html())
+    else:
+        run(*run_args)
+    return 0
 
 if __name__ == '__main__':
 	main()
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import os.path
+import json
+import time
+import random
+import string
+import shutil
+import resource
+import tempfile
+import platform
+import subprocess as subp
+from collections import OrderedDict
+
+'''
+Benchmarks AssemBlender on synthetic assemblies.
+
+Each case generates a fasta of contigs cut from random chains with nucmer-style overlaps between neighbouring contigs, plus repeat families shared by unrelated contigs. The case is then run in its own process so every stage (fasta load, overlap parse, merge, write) is timed on a fresh interpreter and peak RSS belongs to that case alone.
+Results are written as JSON so runs of different versions can be compared.
+'''
+
+suites = OrderedDict([
+    ("small", OrderedDict([("contigs", 2000), ("chain_length", 20)])),
+    ("medium", OrderedDict([("contigs", 20000), ("chain_length", 50)])),
+    ("large", OrderedDict([("contigs", 100000), ("chain_length", 100)])),
+    ("repeats", OrderedDict([("contigs", 20000), ("chain_length", 50), ("repeat_fraction", 0.2), ("repeat_copies", 50)])),
+])
+
+default_case = OrderedDict([
+    ("contigs", 2000),
+    ("length_dist", "uniform"),
+    ("min_length", 500),
+    ("max_length", 5000),
+    ("chain_length", 20),
+    ("repeat_fraction", 0.0),
+    ("repeat_copies", 10),
+    ("repeat_length", 200),
+    ("seed", 1),
+])
+
+default_options = OrderedDict([
+    ("suite", "small"),
+    ("output", "benchmark.json"),
+    ("label", ""),
+    ("repeat", 1),
+    ("threads", 1),
+    ("numpy", False),
+    ("workdir", ""),
+    ("keep", False),
+])
+
+def usage():
+    print "Usage: benchmark.py [options]"
+    print ""
+    print "Options:"
+    print "    --suite <names>           comma separated cases to run: " + ", ".join(suites) + " (default small)"
+    print "    --output <file>           JSON file the results are written to (default benchmark.json)"
+    print "    --label <text>            label stored with the results, e.g. a version or commit"
+    print "    --repeat <int>            runs per case; the fastest run is kept (default 1)"
+    print "    --threads <int>           worker processes for the merge (default 1)"
+    print "    --numpy                   parse overlap lines with numpy"
+    print "    --workdir <dir>           where inputs and outputs are generated (default a temporary directory)"
+    print "    --keep                    keep the generated files"
+    print ""
+    print "Case options (replace the suite with one custom case):"
+    print "    --contigs <int>           number of contigs"
+    print "    --length-dist <name>      contig length distribution: uniform or lognormal"
+    print "    --min-length <int>        shortest contig"
+    print "    --max-length <int>        longest contig"
+    print "    --chain-length <int>      contigs per overlapping chain"
+    print "    --repeat-fraction <float> fraction of contigs carrying a repeat"
+    print "    --repeat-copies <int>     contigs per repeat family"
+    print "    --repeat-length <int>     length of the repeat"
+    print "    --seed <int>              random seed"
+
+def parse_args(argv):
+    '''Returns (cases, options). cases is a list of (name, case settings).'''
+    options = OrderedDict(default_options)
+    custom = OrderedDict()
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        key = arg[2:].replace("-", "_")
+        if arg in ("-h", "--help"):
+            usage()
+            sys.exit(0)
+        if not arg.startswith("--") or (key not in options and key not in default_case):
+            print "Unknown option:", arg
+            usage()
+            sys.exit(-1)
+        default = options[key] if key in options else default_case[key]
+        if isinstance(default, bool):
+            value = True
+        else:
+            i += 1
+            if i == len(argv):
+                print "Missing value for", arg
+                sys.exit(-1)
+            try:
+                value = type(default)(argv[i])
+            except ValueError:
+                print "Bad value for", arg + ":", argv[i]
+                sys.exit(-1)
+        if key in options:
+            options[key] = value
+        else:
+            custom[key] = value
+        i += 1
+    if custom:
+        case = OrderedDict(default_case)
+        case.update(custom)
+        return [("custom", case)], options
+    cases = []
+    for name in options["suite"].split(","):
+        if name not in suites:
+            print "Unknown suite:", name
+            sys.exit(-1)
+        case = OrderedDict(default_case)
+        case.update(suites[name])
+        cases.append((name, case))
+    return cases, options
+
+bases = string.maketrans("0123456789abcdef", "ACGT" * 4)
+complement = string.maketrans("ACGT", "TGCA")
+
+def random_sequence(length):
+    '''Returns length random bases drawn from the seeded random module, so a case always has the same sequences.'''
+    if length == 0:
+        return ""
+    return ("%0*x" % (length, random.getrandbits(4 * length))).translate(bases)
+
+def contig_length(case):
+    if case["length_dist"] == "lognormal":
+        mu = (case["min_length"] + case["max_length"]) / 2.0
+        length = int(random.lognormvariate(0, 0.5) * mu)
+    else:
+        length = random.randint(case["min_length"], case["max_length"])
+    return min(max(length, case["min_length"]), case["max_length"])
+
+def overlap_row(a, b):
+    '''Returns the nucmer tab row for contig a (ref) against contig b (query), or None if they share fewer than 40 bases.
+    Contigs are (name, chain start, chain end, orientation).'''
+    a_name, a0, a1, a_ori = a
+    b_name, b0, b1, b_ori = b
+    s = max(a0, b0)
+    e = min(a1, b1)
+    if e - s < 40:
+        return None
+    a_len = a1 - a0
+    b_len = b1 - b0
+    if a_ori == 1:
+        ref_start, ref_end = s - a0 + 1, e - a0
+    else:
+        ref_start, ref_end = a1 - e + 1, a1 - s
+    if a_ori == b_ori:
+        strand = 1
+        if b_ori == 1:
+            query_start, query_end = s - b0 + 1, e - b0
+        else:
+            query_start, query_end = b1 - e + 1, b1 - s
+    else:
+        strand = -1
+        if a_ori == 1:
+            query_start, query_end = b1 - s, b1 - e + 1
+        else:
+            query_start, query_end = e - b0, s - b0 + 1
+    ref_align_len = ref_end - ref_start + 1
+    query_align_len = abs(query_end - query_start) + 1
+    tags = []
+    if ref_align_len == a_len and query_align_len == b_len:
+        tags.append("[IDENTITY]")
+    elif ref_align_len == a_len:
+        tags.append("[CONTAINED]")
+    elif query_align_len == b_len:
+        tags.append("[CONTAINS]")
+    else:
+        if ref_start == 1:
+            tags.append("[BEGIN]")
+        if ref_end == a_len:
+            tags.append("[END]")
+    percent_id = random.choice(["100.00", "100.00", "100.00", "99.%02d" % random.randint(0, 99), "98.50", "93.00"])
+    return (ref_start, ref_end, query_start, query_end, ref_align_len, query_align_len, percent_id, a_len, b_len, "%.2f" % (100.0 * ref_align_len / a_len), "%.2f" % (100.0 * query_align_len / b_len), 1, strand, a_name, b_name, " ".join(tags))
+
+def repeat_row(a, b, repeat_length):
+    '''Returns the row for the repeat that starts the forward strand of both a and b.'''
+    a_name, a_len, a_ori = a
+    b_name, b_len, b_ori = b
+    if a_ori == 1:
+        ref_start, ref_end, tag = 1, repeat_length, "[BEGIN]"
+    else:
+        ref_start, ref_end, tag = a_len - repeat_length + 1, a_len, "[END]"
+    if b_ori == 1:
+        query_start, query_end = 1, repeat_length
+    else:
+        query_start, query_end = b_len - repeat_length + 1, b_len
+    strand = 1
+    if a_ori != b_ori:
+        strand = -1
+        query_start, query_end = query_end, query_start
+    return (ref_start, ref_end, query_start, query_end, repeat_length, repeat_length, "99.50", a_len, b_len, "%.2f" % (100.0 * repeat_length / a_len), "%.2f" % (100.0 * repeat_length / b_len), 1, strand, a_name, b_name, tag)
+
+def generate_case(case, prefix):
+    '''Writes prefix.fa and prefix.tab for case and returns the number of contigs and overlap rows.'''
+    random.seed(case["seed"])
+    n = case["contigs"]
+    names = ["ctg%07d" % i for i in xrange(n)]
+    random.shuffle(names)
+    rows = []
+    repeats = []
+    with open(prefix + ".fa", "w") as fasta:
+        i = 0
+        while i < n:
+            chain = []
+            end = 0
+            while len(chain) < case["chain_length"] and i < n:
+                length = contig_length(case)
+                start = max(0, end - random.randint(50, max(50, min(300, length // 2)))) if chain else 0
+                chain.append((names[i], start, start + length, random.choice((1, -1))))
+                end = start + length
+                i += 1
+            genome = random_sequence(end)
+            for name, start, stop, ori in chain:
+                seq = genome[start:stop]
+                if ori == -1:
+                    seq = seq.translate(complement)[::-1]
+                fasta.write(">" + name + "\n")
+                for k in xrange(0, len(seq), 60):
+                    fasta.write(seq[k:k + 60] + "\n")
+                if stop - start > 2 * case["repeat_length"] and random.random() < case["repeat_fraction"]:
+                    repeats.append((name, stop - start, ori))
+            for j, a in enumerate(chain):
+                for b in chain[j + 1:]:
+                    if b[1] >= a[2]:
+                        break
+                    for row in (overlap_row(a, b), overlap_row(b, a)):
+                        if row is not None:
+                            rows.append(row)
+    random.shuffle(repeats)
+    for k in xrange(0, len(repeats), case["repeat_copies"]):
+        family = repeats[k:k + case["repeat_copies"]]
+        for a in family:
+            for b in family:
+                if a is not b:
+                    rows.append(repeat_row(a, b, case["repeat_length"]))
+    rows.sort(key=lambda row: (row[13], row[0]))
+    with open(prefix + ".tab", "w") as tab:
+        tab.write("%s.fa %s.fa\n" % (os.path.basename(prefix), os.path.basename(prefix)))
+        for row in rows:
+            tab.write("\t".join([str(x) for x in row]) + "\n")
+    return n, len(rows)
+
+def peak_rss():
+    '''Peak resident set size of this process so far, in kilobytes.'''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss //= 1024
+    return rss
+
+def run_case(prefix, threads, use_numpy):
+    '''Runs AssemBlender on prefix.fa and prefix.tab in this process and returns the stage timings. The report is streamed during the merge, so its writing counts as merge time. Called in a child process by time_case.'''
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import AssemBlender as ab
+    stages = OrderedDict()
+    def stage(name, start):
+        stages[name] = OrderedDict([("seconds", round(time.time() - start, 4)), ("peak_rss_kb", peak_rss())])
+
+    start = time.time()
+    assembly, contigs = ab.load_assembly(prefix + ".fa")
+    stage("load", start)
+
+    start = time.time()
+    reader = ab.read_overlap_records_numpy if use_numpy else ab.read_overlap_records
+    with open(prefix + ".tab", "r") as f:
+        records = list(reader(f))
+    stage("parse", start)
+
+    start = time.time()
+    report = ab.ReportWriter(prefix + "_report.out")
+    good, bad, covers, processed = ab.merge_tables()
+    if threads > 1:
+        assembly, contigs, good = ab.merge_overlaps_parallel(records, assembly, contigs, good, report, threads)
+    else:
+        assembly, contigs, good = ab.merge_overlaps(records, assembly, contigs, good, bad, covers, processed, report)
+    stage("merge", start)
+
+    start = time.time()
+    ab.report_leftover_good(good, assembly, contigs, report)
+    report.close()
+    ab.write_assembly(assembly, prefix + "_merged.fa")
+    ab.write_contigs(contigs, prefix + "_contigs.out")
+    stage("write", start)
+
+    return OrderedDict([("records", len(records)), ("output_contigs", len(assembly)), ("stages", stages), ("peak_rss_kb", peak_rss())])
+
+def time_case(prefix, options):
+    command = [sys.executable, os.path.abspath(__file__), "--run-case", prefix, str(options["threads"]), str(int(options["numpy"]))]
+    p = subp.Popen(command, stdout=subp.PIPE)
+    out = p.communicate()[0]
+    if p.returncode != 0:
+        print "Case", prefix, "failed with exit code", p.returncode
+        sys.exit(-1)
+    return json.loads(out.splitlines()[-1], object_pairs_hook=OrderedDict)
+
+def git_version():
+    try:
+        p = subp.Popen(["git", "describe", "--always", "--dirty"], stdout=subp.PIPE, stderr=subp.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+        out = p.communicate()[0].strip()
+    except OSError:
+        return ""
+    return out if p.returncode == 0 else ""
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == "--run-case":
+        print json.dumps(run_case(sys.argv[2], int(sys.argv[3]), sys.argv[4] == "1"))
+        return 0
+    cases, options = parse_args(sys.argv[1:])
+    workdir = options["workdir"] or tempfile.mkdtemp(prefix="assemblender_bench_")
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    results = OrderedDict([
+        ("label", options["label"]),
+        ("version", git_version()),
+        ("python", platform.python_version()),
+        ("platform", platform.platform()),
+        ("date", time.strftime("%Y-%m-%dT%H:%M:%S")),
+        ("threads", options["threads"]),
+        ("numpy", options["numpy"]),
+        ("cases", []),
+    ])
+    try:
+        for name, case in cases:
+            prefix = os.path.join(workdir, name)
+            start = time.time()
+            n, rows = generate_case(case, prefix)
+            print "%s: %d contigs, %d overlap rows generated in %.1fs" % (name, n, rows, time.time() - start)
+            best = None
+            for i in xrange(options["repeat"]):
+                run = time_case(prefix, options)
+                total = sum([stage["seconds"] for stage in run["stages"].values()])
+                run["total_seconds"] = round(total, 4)
+                if best is None or total < best["total_seconds"]:
+                    best = run
+            print "    " + "  ".join(["%s %.3fs" % (stage, values["seconds"]) for stage, values in best["stages"].items()]) + "  total %.3fs  peak RSS %d kB" % (best["total_seconds"], best["peak_rss_kb"])
+            result = OrderedDict([("name", name), ("settings", case)])
+            result.update(best)
+            results["cases"].append(result)
+    finally:
+        if not options["keep"] and not options["workdir"]:
+            shutil.rmtree(workdir, ignore_errors=True)
+    with open(options["output"], "w") as out:
+        json.dump(results, out, indent=2)
+        out.write("\n")
+    print "Results written to", options["output"]
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())